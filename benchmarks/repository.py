@@ -0,0 +1,242 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import random
+import re
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+GROUP = 'org.bench'
+TIMESTAMP = '20140101.120000'
+BUILD_NUMBER = '7'
+
+RELEASE = 'release'
+# timestamped snapshot builds, listed in maven-metadata.xml
+UNIQUE_SNAPSHOT = 'unique-snapshot'
+# snapshots deployed as plain -SNAPSHOT files
+NON_UNIQUE_SNAPSHOT = 'non-unique-snapshot'
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class ArtifactSpec(object):
+
+    def __init__(self, index, kind, size):
+        self.index = index
+        self.kind = kind
+        self.size = size
+        self.artifactid = 'artifact%d' % index
+        self.version = '1.0' if kind == RELEASE else '1.0-SNAPSHOT'
+
+    @property
+    def coordinates(self):
+        return '%s:%s:%s' % (GROUP, self.artifactid, self.version)
+
+    @property
+    def directory(self):
+        return '/%s/%s/%s/' % (GROUP.replace('.', '/'), self.artifactid, self.version)
+
+    def files(self):
+        """
+        Returns the files of the artifact in a repository, by path.
+        """
+        if self.kind == UNIQUE_SNAPSHOT:
+            basename = '%s-%s-%s-%s' % (self.artifactid, self.version[:-len('-SNAPSHOT')], TIMESTAMP, BUILD_NUMBER)
+        else:
+            basename = '%s-%s' % (self.artifactid, self.version)
+
+        files = {
+            basename + '.jar': random.Random(self.index).getrandbits(8 * self.size).to_bytes(self.size, 'little'),
+            basename + '.pom': self.pom()
+        }
+        if self.kind != RELEASE:
+            files['maven-metadata.xml'] = self.metadata()
+
+        for name in list(files):
+            files[name + '.sha1'] = hashlib.sha1(files[name]).hexdigest().encode('ascii')
+        return dict((self.directory + name, content) for (name, content) in files.items())
+
+    def pom(self):
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<project xmlns="http://maven.apache.org/POM/4.0.0">'
+                '<modelVersion>4.0.0</modelVersion><groupId>%s</groupId><artifactId>%s</artifactId>'
+                '<version>%s</version><packaging>jar</packaging></project>'
+                % (GROUP, self.artifactid, self.version)).encode('utf-8')
+
+    def metadata(self):
+        versions = ''
+        if self.kind == UNIQUE_SNAPSHOT:
+            value = '%s-%s-%s' % (self.version[:-len('-SNAPSHOT')], TIMESTAMP, BUILD_NUMBER)
+            versions = '<snapshotVersions>%s</snapshotVersions>' % ''.join(
+                '<snapshotVersion><extension>%s</extension><value>%s</value><updated>%s</updated></snapshotVersion>'
+                % (extension, value, TIMESTAMP.replace('.', '')) for extension in ('jar', 'pom'))
+
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<metadata><groupId>%s</groupId><artifactId>%s</artifactId><version>%s</version>'
+                '<versioning><snapshot><timestamp>%s</timestamp><buildNumber>%s</buildNumber></snapshot>'
+                '<lastUpdated>%s</lastUpdated>%s</versioning></metadata>'
+                % (GROUP, self.artifactid, self.version, TIMESTAMP, BUILD_NUMBER, TIMESTAMP.replace('.', ''),
+                   versions)).encode('utf-8')
+
+
+def generate_catalog(count, size, snapshots=0.2):
+    """
+    Generates the specs of count artifacts, a snapshots fraction of which are snapshots,
+    alternatively unique and non-unique.
+    """
+    every = int(round(1 / snapshots)) if snapshots > 0 else 0
+    specs = []
+    for i in range(count):
+        if every and i % every == every - 1:
+            kind = UNIQUE_SNAPSHOT if (i // every) % 2 == 0 else NON_UNIQUE_SNAPSHOT
+        else:
+            kind = RELEASE
+        specs.append(ArtifactSpec(i, kind, size))
+    return specs
+
+
+class RepositoryStats(object):
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.not_found = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, status, size):
+        with self._lock:
+            self.requests += 1
+            self.bytes += size
+            if status == 404:
+                self.not_found += 1
+            elif status >= 500:
+                self.errors += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {'requests': self.requests, 'bytes': self.bytes,
+                    'not-found': self.not_found, 'errors': self.errors}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._answer(body=False)
+
+    def do_GET(self):
+        self._answer(body=True)
+
+    def _send(self, status, headers=(), content=b'', body=True):
+        self.send_response(status)
+        for (key, value) in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if body:
+            self.wfile.write(content)
+        self.server.repository.stats.record(status, len(content) if body else 0)
+
+    def _answer(self, body):
+        repository = self.server.repository
+        if repository.latency > 0:
+            time.sleep(repository.latency)
+
+        if repository.fails():
+            self._send(503, content=b'Injected error', body=body)
+            return
+
+        content = repository.files.get(self.path.split('?', 1)[0])
+        if content is None:
+            self._send(404, body=body)
+            return
+
+        etag = '"%s"' % hashlib.sha1(content).hexdigest()
+        headers = [('ETag', etag), ('Last-Modified', repository.last_modified), ('Accept-Ranges', 'bytes')]
+
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, headers, body=False)
+            return
+
+        match = RANGE.match(self.headers.get('Range') or '')
+        if match and self.headers.get('If-Range') in (None, etag, repository.last_modified):
+            start = int(match.group(1) or 0)
+            end = min(int(match.group(2) or len(content) - 1), len(content) - 1)
+            if start >= len(content) or start > end:
+                self._send(416, [('Content-Range', 'bytes */%d' % len(content))], body=body)
+                return
+            headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, end, len(content))))
+            self._send(206, headers, content[start:end + 1], body)
+            return
+
+        self._send(200, headers, content, body)
+
+
+class SyntheticRepository(object):
+    """
+    A maven repository served over HTTP from memory, with injectable latency and errors.
+    """
+
+    def __init__(self, specs, latency=0.0, error_rate=0.0, seed=0):
+        self.files = {}
+        for spec in specs:
+            self.files.update(spec.files())
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.last_modified = formatdate(0, usegmt=True)
+        self.stats = RepositoryStats()
+
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._server = None
+
+    def fails(self):
+        if self.error_rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.error_rate
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.repository = self
+        threading.Thread(target=self._server.serve_forever, name='repository', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,284 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from os.path import join
+
+from .repository import SyntheticRepository, generate_catalog, RELEASE, UNIQUE_SNAPSHOT, NON_UNIQUE_SNAPSHOT
+
+# bumped whenever the layout of the results changes
+RESULTS_VERSION = 1
+
+SERVER_NAME = 'bench'
+
+
+def _configure(config, options):
+    """
+    Sets [resolver] options of the tequila configuration from name=value strings.
+    """
+    nodes = dict((method.config_node, method) for method in
+                 [getattr(config, attr) for attr in dir(config)]
+                 if callable(method) and getattr(method, 'config_section', None) == 'resolver')
+
+    for option in options:
+        name, _, value = option.partition('=')
+        if name not in nodes:
+            raise SystemExit('Unknown resolver option %s' % name)
+
+        method = nodes[name]
+        if method.config_type == bool:
+            value = value.lower() in ('1', 'yes', 'true', 'on')
+        elif method.config_type in (int, float):
+            value = method.config_type(value)
+        method(value)
+
+
+class Bench(object):
+    """
+    Serves a synthetic artifact catalog from several repositories, each artifact being
+    hosted by a single one of them so that the others answer with 404.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.specs = generate_catalog(args.artifacts, args.size, args.snapshots)
+
+        # the last artifacts are hosted nowhere
+        hosted = len(self.specs) - int(round(len(self.specs) * args.missing))
+        self.repositories = [SyntheticRepository([spec for spec in self.specs[:hosted]
+                                                  if spec.index % args.repositories == i],
+                                                 args.latency, args.error_rate, seed=i)
+                             for i in range(args.repositories)]
+        self.work = None
+
+    def start(self):
+        for repository in self.repositories:
+            repository.start()
+        self.work = tempfile.mkdtemp(prefix='tequila-bench')
+
+        from tequila import Tequila
+        config = Tequila().config
+        config.get_local_repository(join(self.work, 'm2'))
+        config.get_cache_directory(join(self.work, 'cache'))
+        config.get_progress_mode('none')
+        _configure(config, self.args.option)
+        os.environ['TEQUILA_HOME'] = join(self.work, 'home')
+
+    def stop(self):
+        for repository in self.repositories:
+            repository.stop()
+        shutil.rmtree(self.work, ignore_errors=True)
+
+    def reset(self):
+        """
+        Forgets everything downloaded or deployed so far.
+        """
+        for directory in ('m2', 'cache', 'home'):
+            shutil.rmtree(join(self.work, directory), ignore_errors=True)
+
+    def counters(self):
+        totals = {}
+        for repository in self.repositories:
+            for (key, value) in repository.stats.to_dict().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def repository_list(self):
+        from tequila.network import Repository
+        return [Repository('repo%d' % i, repository.url) for (i, repository) in enumerate(self.repositories)]
+
+    def resolve(self, refresh=False, update=False):
+        from tequila import Tequila
+        from tequila.network import Artifact, ArtifactResolver, ArtifactUnresolvedException
+
+        resolver = ArtifactResolver(Tequila().config)
+        resolver.refresh = refresh or update
+        resolver.update_snapshots = update
+        resolver.repositories = self.repository_list()
+        for spec in self.specs:
+            resolver.enqueue(Artifact.from_string(spec.coordinates))
+
+        try:
+            resolver.resolve()
+        except ArtifactUnresolvedException as e:
+            return len(e.unresolved)
+        return 0
+
+    def create_server(self):
+        from tequila import Server
+
+        server = Server(SERVER_NAME)
+        lines = ['[general]',
+                 'server: %s' % self.specs[0].coordinates,
+                 'wrapper-type: daemon',
+                 '',
+                 '[repositories]']
+        lines += ['%s: %s' % (repository.name, repository.url) for repository in self.repository_list()]
+        lines += ['', '[plugins]']
+        lines += ['%s: %s' % (spec.artifactid, spec.coordinates) for spec in self.specs[1:]]
+
+        os.makedirs(server.configuration_directory, exist_ok=True)
+        with open(join(server.configuration_directory, 'tequila.config'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def deploy(self, update=False):
+        from tequila import Server
+        from tequila.exception import TequilaException
+
+        try:
+            Server(SERVER_NAME).load(watch=False).filesystem.deploy(update=update)
+        except TequilaException as e:
+            logging.getLogger('bench').debug(e.message)
+            return 1
+        return 0
+
+
+def _prepare_nothing(bench):
+    bench.reset()
+
+
+def _prepare_resolved(bench):
+    bench.reset()
+    bench.resolve()
+
+
+def _prepare_server(bench):
+    bench.reset()
+    bench.create_server()
+
+
+def _prepare_deployed(bench):
+    _prepare_server(bench)
+    bench.deploy()
+
+
+# name: (description, preparation run before each iteration, timed function)
+SCENARIOS = {
+    'resolve-cold': ('resolve into an empty local repository',
+                     _prepare_nothing, lambda bench: bench.resolve()),
+    'resolve-warm': ('resolve artifacts already in the local repository',
+                     _prepare_resolved, lambda bench: bench.resolve()),
+    'resolve-update': ('look for newer builds of the snapshots already in the local repository',
+                       _prepare_resolved, lambda bench: bench.resolve(update=True)),
+    'deploy-cold': ('deploy a server and its plugins from scratch',
+                    _prepare_server, lambda bench: bench.deploy()),
+    'deploy-noop': ('deploy a server again without any change',
+                    _prepare_deployed, lambda bench: bench.deploy()),
+    'deploy-update': ('deploy a server again looking for newer snapshot builds',
+                      _prepare_deployed, lambda bench: bench.deploy(update=True)),
+}
+
+
+def run_scenario(bench, name, iterations):
+    description, prepare, timed = SCENARIOS[name]
+    runs = []
+    for _ in range(iterations):
+        prepare(bench)
+
+        before = bench.counters()
+        start = time.perf_counter()
+        failures = timed(bench)
+        seconds = time.perf_counter() - start
+        after = bench.counters()
+
+        run = dict((key, after[key] - before[key]) for key in after)
+        run.update({'seconds': round(seconds, 6), 'failures': failures})
+        runs.append(run)
+
+    durations = [run['seconds'] for run in runs]
+    return {
+        'description': description,
+        'runs': runs,
+        'min': min(durations),
+        'median': round(statistics.median(durations), 6),
+        'max': max(durations),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Times artifact resolution and deploys against local '
+                                                 'synthetic maven repositories.')
+    parser.add_argument('-n', '--artifacts', type=int, default=20, help='number of artifacts')
+    parser.add_argument('-m', '--repositories', type=int, default=2, help='number of repositories')
+    parser.add_argument('--size', type=int, default=256 * 1024, help='size of the jars in bytes')
+    parser.add_argument('--snapshots', type=float, default=0.2, help='fraction of snapshot artifacts')
+    parser.add_argument('--missing', type=float, default=0.0, help='fraction of artifacts hosted nowhere')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing with 503')
+    parser.add_argument('-i', '--iterations', type=int, default=3, help='runs per scenario')
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, may be repeated (default: all)')
+    parser.add_argument('-c', '--option', action='append', default=[], metavar='NAME=VALUE',
+                        help='[resolver] option of the tequila configuration, may be repeated')
+    parser.add_argument('-o', '--output', help='file to write the results to (default: stdout)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the logs of tequila')
+    args = parser.parse_args(argv)
+
+    if args.repositories < 1 or args.artifacts < 1:
+        parser.error('at least one artifact and one repository are needed')
+
+    bench = Bench(args)
+    bench.start()
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.ERROR)
+
+    try:
+        results = dict((name, run_scenario(bench, name, args.iterations))
+                       for name in (args.scenario or sorted(SCENARIOS)))
+    finally:
+        bench.stop()
+
+    kinds = [spec.kind for spec in bench.specs]
+    report = {
+        'version': RESULTS_VERSION,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'parameters': {
+            'artifacts': args.artifacts,
+            'releases': kinds.count(RELEASE),
+            'unique-snapshots': kinds.count(UNIQUE_SNAPSHOT),
+            'non-unique-snapshots': kinds.count(NON_UNIQUE_SNAPSHOT),
+            'repositories': args.repositories,
+            'size': args.size,
+            'missing': args.missing,
+            'latency': args.latency,
+            'error-rate': args.error_rate,
+            'iterations': args.iterations,
+            'options': sorted(args.option),
+        },
+        'scenarios': results,
+    }
+
+    text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
@@ -19,6 +19,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
 import os
+import sys
 import baker
 
 # register all commands
@@ -55,6 +56,7 @@ class Tequila(object):
             baker.run()
         except TequilaException as e:
             self.logger.error(e.message)
+            sys.exit(1)
 
     @staticmethod
     def get_dir():
@@ -76,6 +78,14 @@ class Tequila(object):
         from os.path import join
         return join(self.get_home(), 'groups')
 
+    def get_store_dir(self):
+        from os.path import join
+        return join(self.get_home(), 'store')
+
+    def get_port_leases_file(self):
+        from os.path import join
+        return join(self.get_home(), 'ports.json')
+
     def get_servers(self):
         return os.listdir(self.get_servers_dir())
 
@@ -92,3 +102,71 @@ class TequilaConfig(Config):
     @config_node('general', 'use-git')
     def uses_git(self):
         return True
+
+    @config_node('concurrency', section='resolver', type=int)
+    def get_resolver_concurrency(self):
+        return 4
+
+    @config_node('repository-connections', section='resolver', type=int)
+    def get_repository_connections(self):
+        return 2
+
+    @config_node('max-connections', section='resolver', type=int)
+    def get_max_connections(self):
+        return 0
+
+    @config_node('bandwidth', section='resolver')
+    def get_bandwidth(self):
+        return ''
+
+    @config_node('buffer-size', section='resolver', type=int)
+    def get_buffer_size(self):
+        return 64 * 1024
+
+    @config_node('segments', section='resolver', type=int)
+    def get_download_segments(self):
+        return 4
+
+    @config_node('segment-threshold', section='resolver', type=int)
+    def get_segment_threshold(self):
+        return 8 * 1024 * 1024
+
+    @config_node('local-repository', section='resolver')
+    def get_local_repository(self):
+        return '~/.m2/repository'
+
+    @config_node('cache-directory', section='resolver')
+    def get_cache_directory(self):
+        return '~/.cache/tequila'
+
+    @config_node('metadata-ttl', section='resolver', type=int)
+    def get_metadata_ttl(self):
+        return 300
+
+    @config_node('miss-ttl', section='resolver', type=int)
+    def get_miss_ttl(self):
+        return 24 * 3600
+
+    @config_node('adaptive-order', section='resolver', type=bool)
+    def uses_adaptive_order(self):
+        return True
+
+    @config_node('race', section='resolver', type=bool)
+    def races_repositories(self):
+        return False
+
+    @config_node('offline', section='resolver', type=bool)
+    def is_offline(self):
+        return False
+
+    @config_node('deploy-method', section='resolver')
+    def get_deploy_method(self):
+        return 'hardlink'
+
+    @config_node('progress', section='resolver')
+    def get_progress_mode(self):
+        return 'auto'
+
+    @config_node('use-maven', section='resolver', type=bool)
+    def uses_maven(self):
+        return False
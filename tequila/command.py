@@ -76,18 +76,47 @@ def cmd_delete(server):
     Server(server).load(watch=False).delete()
 
 
+def deploy_entity(name=None, all=False, **kwargs):
+    from .server.fleet import Fleet
+
+    if all:
+        from . import Tequila
+        Fleet([Server(s) for s in sorted(Tequila().get_servers())]).deploy(**kwargs)
+    elif name is not None and name[0] == '@':
+        Fleet(list(ServerGroup(name[1:]).load(watch=False).servers.values())).deploy(**kwargs)
+    elif name is not None:
+        server = Server(name).load()
+        if get_uid(server.config.get_user()) != os.getuid():
+            server.logger.error('Please run this command as user \'%s\'.', server.config.get_user())
+            return
+
+        server.deploy(**kwargs)
+    else:
+        from . import Tequila
+        Tequila().logger.error('Please give a server, a @group, or --all.')
+
+
 @command(name='deploy')
-def cmd_deploy(server):
+def cmd_deploy(server=None, refresh=False, offline=False, stage=False, all=False):
     """
     Deploys a server, copying all binaries where they belong
-    :param server: The server to deploy
+    :param server: The server or @group to deploy
+    :param refresh: ignore cached repository metadata and misses
+    :param offline: only use the artifacts already in the local repository
+    :param stage: prepare the deploy while the server runs, and apply it on the next restart with --apply_staged
+    :param all: deploy every server
     """
-    server = Server(server).load()
-    if get_uid(server.config.get_user()) != os.getuid():
-        server.logger.error('Please run this command as user \'%s\'.', server.config.get_user())
-        return
+    deploy_entity(server, all, refresh=refresh, offline=offline, stage=stage)
 
-    server.deploy()
+
+@command(name='update')
+def cmd_update(server=None, all=False):
+    """
+    Resolves the artifacts of a server again, deploys them and pins them in tequila.lock
+    :param server: The server or @group to update
+    :param all: update every server
+    """
+    deploy_entity(server, all, update=True)
 
 
 @command(name='status')
@@ -178,15 +207,26 @@ def cmd_stop(entity, force=False, Force=False):
 
 
 @command(name='restart', shortopts={'force': 'f', 'Force': 'F'})
-def cmd_restart(entity, force=False, Force=False):
+def cmd_restart(entity, force=False, Force=False, apply_staged=False):
     """
     Restarts an entity.
     :param server: The entity to restart
     :param force: send a SIGTERM to the entity
     :param Force: send a SIGKILL to the entity
+    :param apply_staged: apply the staged deploy while the entity is stopped
     """
-    get_controllable(entity, load=True, watch=False).stop(force, Force)
-    cmd_start(entity)
+    controllable = get_controllable(entity, load=True, watch=False)
+    if apply_staged and not isinstance(controllable, (Server, ServerGroup)):
+        controllable.server.logger.error('Staged deploys can only be applied to servers and groups.')
+        return
+
+    controllable.stop(force, Force)
+    try:
+        if apply_staged:
+            controllable.apply_staged()
+    finally:
+        # the entity was stopped, it is started again even if the staged deploy could not be applied
+        cmd_start(entity)
 
 
 @command(name='send')
@@ -199,6 +239,21 @@ def cmd_send(entity, *command):
     get_controllable(entity, load=True, watch=False).send(' '.join(command))
 
 
+@command(name='attach')
+def cmd_attach(entity):
+    """
+    Attach to the console of a server or of an instance.
+    :param entity: The server or instance to attach to
+    """
+    controllable = get_controllable(entity, load=True, watch=False)
+    if not isinstance(controllable, (Server, ServerInstance)):
+        from . import Tequila
+        Tequila().logger.error('Only the console of a single server or instance can be attached to.')
+        return
+
+    controllable.attach()
+
+
 group_bakery = Baker()
 
 
@@ -249,14 +304,17 @@ def cmd_group_delete(name):
 
 
 @command(name='download')
-def cmd_download(*urls):
+def cmd_download(file=None, *urls):
     """
-    Download and install an artifact from an url.
+    Download and install plugins from urls.
+    :param file: a file listing urls to download, one per line
     :param urls: the urls to download
     """
-    from urllib.request import FancyURLopener
-    from tequila.network.maven import ArtifactResolver
+    from tequila.network import ArtifactResolver
+
+    urls = list(urls)
+    if file is not None:
+        with open(file, 'r') as f:
+            urls += [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
 
-    maven_resolver = ArtifactResolver()
-    for url in urls:
-        maven_resolver.install_plugin_jar(FancyURLopener(), url)
\ No newline at end of file
+    ArtifactResolver().install_plugin_jars(urls)
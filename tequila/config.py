@@ -64,6 +64,11 @@ def load(config: ConfigParser, obj, section):
                     val = config.getboolean(real_section, method.config_node, fallback=False)
                 except ValueError:
                     val = False
+            elif method.config_type in (int, float):
+                try:
+                    val = method.config_type(val)
+                except ValueError:
+                    val = method(default=True)
             elif issubclass(method.config_type, Enum):
                 val = method.config_type.from_string(val)
 
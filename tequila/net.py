@@ -17,7 +17,10 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 from collections import namedtuple
+import errno
+import os
 import socket
+import struct
 
 NetState = {
     '01': 'ESTABLISHED',
@@ -45,6 +48,26 @@ NetInfo = namedtuple('NetInfo', [
 
 NetAddress = namedtuple('NetAddress', ['host', 'port'])
 
+# from linux/netlink.h, linux/sock_diag.h and linux/inet_diag.h
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 0x2
+NLMSG_DONE = 0x3
+INET_DIAG_REQ_BYTECODE = 1
+INET_DIAG_BC_S_GE = 2
+INET_DIAG_BC_S_LE = 3
+TCP_LISTEN = 10
+
+NLMSG_HEADER = struct.Struct('=IHHII')
+# family, protocol, extensions, padding, states, then the socket id: ports, addresses, interface and cookie
+INET_DIAG_REQ = struct.Struct('=BBBxI4x16s16sI8x')
+INET_DIAG_BC_OP = struct.Struct('=BBH')
+NLATTR_HEADER = struct.Struct('=HH')
+# the source port of an inet_diag_msg, after family, state, timer and retransmits
+INET_DIAG_MSG_SPORT = struct.Struct('!4xH')
+
 
 def _hex_to_dec(s):
     return str(int(s, 16))
@@ -82,6 +105,24 @@ class TCP_IPv4(object):
                 status.append(self.parse_proc_net_line(line))
             return status
 
+    def listening_ports(self, low, high):
+        """
+        Streams the table for the ports in [low, high] with a listening socket,
+        only parsing the local port of the sockets in the LISTEN state.
+        """
+        ports = set()
+        with open(self.proc_path, 'r') as proc:
+            next(proc, None)
+            for line in proc:
+                fields = line.split(None, 4)
+                if len(fields) < 4 or fields[3] != '0A':
+                    continue
+
+                port = int(fields[1].rsplit(':', 1)[1], 16)
+                if low <= port <= high:
+                    ports.add(port)
+        return ports
+
 
 class TCP_IPv6(TCP_IPv4):
 
@@ -111,20 +152,89 @@ class TCP_IPv6(TCP_IPv4):
         return NetInfo(arr[0][:-1], self.parse_addr(arr[1]), self.parse_addr(arr[2]), NetState[arr[3]], arr[4], arr[7], arr[8])
 
 
-def get_open_ports(low=2 << 10, high=(2 << 16) - 1):
-    stat = TCP_IPv4().netstat()
-    stat.extend(TCP_IPv6().netstat())
-
-    ports = set(range(low, high+1))
-    for s in stat:
-        if s.state != 'LISTEN':
-            continue
+def _port_range_filter(low, high):
+    """
+    Compiles an inet_diag bytecode program accepting the sockets whose local port is within [low, high].
+    A program accepts a socket when its last jump lands exactly at its end, jumping past it rejects.
+    """
+    reject = 2 * 2 * INET_DIAG_BC_OP.size + 4
+    return b''.join([
+        INET_DIAG_BC_OP.pack(INET_DIAG_BC_S_GE, 2 * INET_DIAG_BC_OP.size, reject),
+        INET_DIAG_BC_OP.pack(0, 0, low),
+        INET_DIAG_BC_OP.pack(INET_DIAG_BC_S_LE, 2 * INET_DIAG_BC_OP.size, reject - 2 * INET_DIAG_BC_OP.size),
+        INET_DIAG_BC_OP.pack(0, 0, high),
+    ])
+
+
+def _sock_diag_listening_ports(family, low, high):
+    """
+    Asks the kernel for the listening TCP sockets of an address family with a local port in [low, high].
+    """
+    bytecode = _port_range_filter(low, high)
+    payload = INET_DIAG_REQ.pack(family, socket.IPPROTO_TCP, 0, 1 << TCP_LISTEN, b'', b'', 0) \
+        + NLATTR_HEADER.pack(NLATTR_HEADER.size + len(bytecode), INET_DIAG_REQ_BYTECODE) + bytecode
+    request = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(payload), SOCK_DIAG_BY_FAMILY,
+                                NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + payload
+
+    ports = set()
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG) as sock:
+        sock.sendall(request)
+        while True:
+            data = sock.recv(64 * 1024)
+            offset = 0
+            while offset + NLMSG_HEADER.size <= len(data):
+                length, type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+                if type == NLMSG_DONE:
+                    return ports
+                if type == NLMSG_ERROR:
+                    code = -struct.unpack_from('=i', data, offset + NLMSG_HEADER.size)[0]
+                    raise OSError(code, os.strerror(code))
+
+                ports.add(INET_DIAG_MSG_SPORT.unpack_from(data, offset + NLMSG_HEADER.size)[0])
+                # messages are aligned on 4 bytes
+                offset += (length + 3) & ~3
+
+            if len(data) == 0:
+                return ports
+
+
+def get_listening_ports(low=2 << 10, high=(2 << 16) - 1):
+    """
+    Returns the local ports in [low, high] with a listening TCP socket, in IPv4 or IPv6.
+    The kernel is asked over netlink for the matching sockets only, /proc is parsed
+    if sock_diag is not available.
+    """
+    try:
+        return _sock_diag_listening_ports(socket.AF_INET, low, high) \
+            | _sock_diag_listening_ports(socket.AF_INET6, low, high)
+    except (OSError, AttributeError):
+        pass
+
+    ports = set()
+    for table in (TCP_IPv4(), TCP_IPv6()):
+        try:
+            ports |= table.listening_ports(low, high)
+        except IOError as e:
+            # IPv6 may be disabled
+            if e.errno != errno.ENOENT:
+                raise
+    return ports
+
+
+def get_open_port(low=2 << 10, high=(2 << 16) - 1):
+    """
+    Returns the lowest port in [low, high] without a listening TCP socket, or None.
+    """
+    listening = get_listening_ports(low, high)
+    for port in range(low, high + 1):
+        if port not in listening:
+            return port
+    return None
 
-        port = s.local_address.port
-        if low <= port <= high and port in ports:
-            ports.remove(port)
 
-    return sorted(ports)
+def get_open_ports(low=2 << 10, high=(2 << 16) - 1):
+    listening = get_listening_ports(low, high)
+    return [port for port in range(low, high + 1) if port not in listening]
 
 
 class socket_connection(object):
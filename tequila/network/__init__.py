@@ -19,10 +19,19 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from .download import download
 
+from .transport import Transport, TransportError
+
 from .maven import Artifact, \
     ArtifactResolver, \
     Repository, \
     ArtifactUnresolvedException, \
+    InvalidRepositoryException, \
     InvalidPluginMetaException, \
     NotAPluginException, \
-    MavenMetadata
\ No newline at end of file
+    PluginsNotInstalledException, \
+    MavenMetadata, \
+    Pin
+
+from .lock import Lockfile
+
+from .store import ArtifactStore
\ No newline at end of file
@@ -0,0 +1,221 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from os.path import join, exists
+from tempfile import mkstemp
+
+from ..util import dump_json
+
+
+def _key(*parts):
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _load_json(file, default):
+    try:
+        with open(file, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return default
+
+
+class MetadataCacheEntry(object):
+
+    def __init__(self, file, url, etag=None, last_modified=None, fetched=0):
+        self.file = file
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = fetched
+
+    def is_fresh(self, ttl):
+        return time.time() - self.fetched < ttl
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class MetadataCache(object):
+    """
+    Keeps downloaded maven-metadata.xml files on disk along with their HTTP validators,
+    so that they can be reused as-is for ttl seconds and revalidated with a conditional request afterwards.
+    """
+
+    def __init__(self, directory, ttl):
+        self.directory = join(directory, 'metadata')
+        self.ttl = ttl
+
+    def _paths(self, url):
+        key = _key(url)
+        return join(self.directory, key + '.xml'), join(self.directory, key + '.json')
+
+    def get(self, url):
+        file, index = self._paths(url)
+        info = _load_json(index, None)
+        if info is None or info.get('url') != url or not exists(file):
+            return None
+
+        return MetadataCacheEntry(file, url, info.get('etag'), info.get('last_modified'), info.get('fetched', 0))
+
+    def temporary_file(self):
+        os.makedirs(self.directory, 0o755, exist_ok=True)
+        fd, tmp = mkstemp(dir=self.directory, prefix='.tequila')
+        os.close(fd)
+        return tmp
+
+    def store(self, url, tmp, response):
+        file, index = self._paths(url)
+        os.replace(tmp, file)
+
+        entry = MetadataCacheEntry(file, url, response.getheader('ETag'), response.getheader('Last-Modified'))
+        return self.touch(entry)
+
+    def touch(self, entry):
+        entry.fetched = time.time()
+        dump_json(self._paths(entry.url)[1], {
+            'url': entry.url,
+            'etag': entry.etag,
+            'last_modified': entry.last_modified,
+            'fetched': entry.fetched
+        })
+        return entry
+
+
+class MissCache(object):
+    """
+    Remembers which repositories answered that they do not have an artifact, so that they
+    are not asked again for ttl seconds, and which repository last provided it.
+    """
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.file = join(directory, 'misses.json')
+        self.ttl = ttl
+
+        self._misses = {}
+        self._hits = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(repository, artifact):
+        return repository.url + ' ' + artifact.name
+
+    def load(self):
+        data = _load_json(self.file, {})
+        now = time.time()
+        with self._lock:
+            self._misses = dict((k, t) for (k, t) in data.get('misses', {}).items() if now - t < self.ttl)
+            self._hits = data.get('hits', {})
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'misses': dict(self._misses), 'hits': dict(self._hits)}
+            self._dirty = False
+
+        os.makedirs(self.directory, 0o755, exist_ok=True)
+        dump_json(self.file, data)
+
+    def missed(self, repository, artifact):
+        with self._lock:
+            t = self._misses.get(self._key(repository, artifact))
+        return t is not None and time.time() - t < self.ttl
+
+    def preferred(self, artifact):
+        with self._lock:
+            return self._hits.get(artifact.name)
+
+    def record_miss(self, repository, artifact):
+        with self._lock:
+            self._misses[self._key(repository, artifact)] = time.time()
+            self._dirty = True
+
+    def record_hit(self, repository, artifact):
+        with self._lock:
+            self._misses.pop(self._key(repository, artifact), None)
+            self._hits[artifact.name] = repository.url
+            self._dirty = True
+
+
+class RepositoryStats(object):
+    """
+    Tracks the latency and the success rate of the requests made to each repository,
+    so that lookups can be made in the repositories most likely to answer quickly first.
+    """
+
+    # weight of the latest sample in the latency moving average
+    ALPHA = 0.3
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.file = join(directory, 'repositories.json')
+
+        self._stats = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        stats = _load_json(self.file, {})
+        with self._lock:
+            self._stats = stats
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = dict((url, dict(s)) for (url, s) in self._stats.items())
+            self._dirty = False
+
+        os.makedirs(self.directory, 0o755, exist_ok=True)
+        dump_json(self.file, data)
+
+    def record(self, repository, latency, ok):
+        with self._lock:
+            stats = self._stats.setdefault(repository.url, {'latency': latency, 'successes': 0, 'failures': 0})
+            if ok:
+                stats['successes'] += 1
+                stats['latency'] += self.ALPHA * (latency - stats['latency'])
+            else:
+                stats['failures'] += 1
+            self._dirty = True
+
+    def score(self, repository):
+        """
+        Returns the expected cost of a request to the repository, repositories without history scoring 0.
+        """
+        with self._lock:
+            stats = self._stats.get(repository.url)
+            if stats is None:
+                return 0
+
+            total = stats['successes'] + stats['failures']
+            success_rate = stats['successes'] / total if total > 0 else 1
+            return stats['latency'] / max(0.05, success_rate)
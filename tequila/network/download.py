@@ -17,11 +17,20 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import fcntl
 import hashlib
-import math
-import sys
+import json
+import os
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.client import IncompleteRead
+from os.path import join, exists, getsize
 
 from ..exception import TequilaException
+from .transport import TransportError
 
 
 class ChecksumNotMatchingError(TequilaException):
@@ -29,15 +38,60 @@ class ChecksumNotMatchingError(TequilaException):
         super().__init__("File hashes not matching, got \"%s\" where expecting \"%s\"" % (actual, expected))
 
 
-def checksum(file):
+class ChecksumNotFoundError(ChecksumNotMatchingError):
+    def __init__(self, url):
+        TequilaException.__init__(self, 'No checksum file at $url', url=url)
+
+
+def sha1sum(file, buffer_size=64 * 1024):
     sha1 = hashlib.sha1()
-    with open(file, 'rb') as f, \
-            open(file + '.sha1', 'r') as file_hash:
-        sha1.update(f.read())
-        sum1 = sha1.hexdigest()
-        sum2 = file_hash.read().strip()
-        if sum1 != sum2:
-            raise ChecksumNotMatchingError(sum1, sum2)
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(buffer_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class DigestCache(object):
+    """
+    Remembers the SHA-1 of the files hashed during a run, by (path, inode, size, modification time),
+    so that files shared by several servers are only read once.
+    """
+
+    def __init__(self, buffer_size=64 * 1024):
+        self.buffer_size = buffer_size
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def sha1(self, file):
+        st = os.stat(file)
+        key = (file, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            digest = self._digests.get(key)
+        if digest is None:
+            digest = sha1sum(file, self.buffer_size)
+            with self._lock:
+                self._digests[key] = digest
+        return digest
+
+
+def parse_checksum(data):
+    """
+    Extracts the hash of a .sha1 file, which may be followed by the file name.
+    """
+    fields = data.decode('ascii', 'replace').split()
+    if len(fields) == 0:
+        raise ValueError('Empty checksum file')
+    return fields[0].lower()
+
+
+def verify(actual, expected):
+    if actual != expected:
+        raise ChecksumNotMatchingError(actual, expected)
+
+
+def checksum(file):
+    with open(file + '.sha1', 'rb') as file_hash:
+        verify(sha1sum(file), parse_checksum(file_hash.read()))
 
 
 def bytes_to_human(bytes):
@@ -48,52 +102,327 @@ def bytes_to_human(bytes):
         if bytes < 1:
             break
         n, s = bytes, suffix
-    return ('%.2f' % n)[:4].strip('0.') + ' %sB' % s
+    digits = ('%.2f' % n)[:4]
+    if '.' in digits:
+        digits = digits.rstrip('0').rstrip('.')
+    return digits + ' %sB' % s
+
+
+def _feed(digest, file, buffer_size):
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(buffer_size), b''):
+            digest.update(block)
 
 
-def download(urlopener, name, url, target, validate=False):
-    max_name_size = 26
-    bar_size = 15
-    last = 0
+def _read_range(transport, response, fd, start, end, transfer=None):
+    buffer_size = transport.buffer_size
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
 
-    def reporthook(blocknum, blocksize, totalsize):
-        nonlocal last
-        nonlocal name
+    offset = start
+    while offset <= end:
+        n = transport.readinto(response, view[:min(buffer_size, end + 1 - offset)])
+        if not n:
+            raise IncompleteRead(b'', end + 1 - offset)
+        os.pwrite(fd, view[:n], offset)
+        offset += n
+        if transfer is not None:
+            transfer.advance(n)
 
-        # skip first handling to let propagate any error
-        if blocknum == 0:
-            return
 
-        if len(name) > max_name_size:
-            half = math.floor(max_name_size / 2)
-            name = '...'.join([name[:half], name[-half:]])
+def _fetch_range(transport, url, validator, fd, start, end, transfer=None):
+    headers = {'Range': 'bytes=%d-%d' % (start, end), 'If-Range': validator}
+    with transport.open(url, headers) as response:
+        if response.status != 206:
+            raise IOError('%s changed or does not support range requests anymore' % url)
+        _read_range(transport, response, fd, start, end, transfer)
 
-        percent = min(1e2, blocknum * blocksize * 1e2 / totalsize)
-        progress = min(bar_size, math.floor(blocknum * blocksize * bar_size / totalsize))
 
-        if blocknum == 1:
-            # dirty hack until I find the time to make this better
-            sys.stdout.write('Downloading %s (%s): [%s]   0%%' % (name, bytes_to_human(totalsize), ' ' * bar_size))
-            sys.stdout.write('\033[%dD' % (bar_size + 6))
+def content_range(response):
+    """
+    Returns the first and last byte positions of a 206 response, and the length of the whole content or -1.
+    """
+    match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)$', response.getheader('Content-Range') or '')
+    if match is None:
+        raise IOError('Invalid Content-Range: %s' % response.getheader('Content-Range'))
+    first, last, length = match.groups()
+    return int(first), int(last), int(length) if length != '*' else -1
 
-        if last < progress:
-            sys.stdout.write('#' * (progress - last))
-            sys.stdout.write(
-                '\033[%dC%3d%%\033[%dD' % ((bar_size - progress + 2), percent, (bar_size - progress + 6)))
 
-        if percent >= 1e2:
-            sys.stdout.write('\033[%dC\n' % 6)
+def unsatisfied_range_length(response):
+    """
+    Returns the length of the whole content given by a 416 response, or -1.
+    """
+    match = re.match(r'bytes \*/(\d+)$', response.getheader('Content-Range') or '')
+    return int(match.group(1)) if match is not None else -1
 
-        sys.stdout.flush()
-        last = progress
 
+def retrieve_segments(transport, url, response, f, total, connections, transfer=None):
+    """
+    Fills f with the content of url by fetching it in several byte ranges at the same time.
+    The first range is read from response, which must be a pending 206 answer to a request on url.
+    The rest is split between the given number of other connections, at least one.
+    """
+    validator = response.getheader('ETag') or response.getheader('Last-Modified')
+    fd = f.fileno()
+
+    try:
+        os.posix_fallocate(fd, 0, total)
+    except (AttributeError, OSError):
+        f.truncate(total)
+
+    _, last, _ = content_range(response)
+    size = -(-(total - last - 1) // connections)
+    ranges = [(start, min(total, start + size) - 1) for start in range(last + 1, total, size)]
+
+    executor = ThreadPoolExecutor(max_workers=connections)
     try:
-        sys.stdout.write('\x1B[?25l')  # deactivate cursor
-        urlopener.retrieve(url, target, reporthook)
+        futures = [executor.submit(_fetch_range, transport, url, validator, fd, start, end, transfer)
+                   for (start, end) in ranges]
 
-        if validate:
-            urlopener.retrieve(url + '.sha1', target + '.sha1')
-            checksum(target)
+        _read_range(transport, response, fd, 0, last, transfer)
+
+        for future in futures:
+            future.result()
     finally:
-        sys.stdout.write('\x1B[?25h')  # activate cursor
-        sys.stdout.flush()
\ No newline at end of file
+        executor.shutdown()
+
+
+@contextmanager
+def _unlimited_connections(url, wanted):
+    yield wanted
+
+
+class PartialDownloads(object):
+    """
+    Keeps interrupted downloads in a staging directory, along with a journal holding the url
+    and the validator (ETag or Last-Modified) of the content, so that a later attempt can resume
+    them with a Range request.
+    Segmented downloads open as many more connections as connections(url, wanted) grants: it is
+    entered around the download and yields how many of the wanted connections may be opened.
+    """
+
+    def __init__(self, directory, segments=1, segment_threshold=8 * 1024 * 1024, connections=None):
+        self.directory = join(directory, 'partial')
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.connections = connections or _unlimited_connections
+
+    def _path(self, url, extension):
+        return join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + extension)
+
+    def _paths(self, url):
+        return self._path(url, '.part'), self._path(url, '.json')
+
+    def _journal(self, url):
+        part, journal = self._paths(url)
+        try:
+            with open(journal, 'r') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if entry.get('url') != url or not entry.get('validator') or not exists(part):
+            return None
+        return entry
+
+    def _write_journal(self, url, validator):
+        with open(self._paths(url)[1], 'w') as f:
+            json.dump({'url': url, 'validator': validator}, f)
+
+    @contextmanager
+    def locked(self, url):
+        """
+        Keeps other threads and tequila processes from using the partial download of url.
+        """
+        os.makedirs(self.directory, 0o755, exist_ok=True)
+        path = self._path(url, '.lock')
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                # the previous holder may have removed the file while this one was waiting for it
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+        try:
+            yield
+        finally:
+            os.remove(path)
+            os.close(fd)
+
+    def discard(self, url):
+        for path in self._paths(url):
+            if exists(path):
+                os.remove(path)
+
+    def commit(self, url, target):
+        part, journal = self._paths(url)
+        shutil.move(part, target)
+        # there is no journal when the server sent no validator
+        if exists(journal):
+            os.remove(journal)
+
+    def _retrieve_rest(self, transport, url, start, validator, transfer=None, digest=None):
+        part, _ = self._paths(url)
+        headers = {'Range': 'bytes=%d-' % start}
+        if validator:
+            headers['If-Range'] = validator
+
+        try:
+            with transport.open(url, headers) as response, open(part, 'ab') as f:
+                if response.status != 206:
+                    raise IOError('%s changed or does not support range requests anymore' % url)
+                transport.copy(response, f, transfer, digest)
+        except TransportError as e:
+            # the content length was not known, and the first segment turned out to be the whole of it
+            if e.status != 416:
+                raise
+
+    def retrieve(self, transport, url, transfer=None, digest=None, headers=None):
+        part, _ = self._paths(url)
+        os.makedirs(self.directory, 0o755, exist_ok=True)
+
+        entry = self._journal(url)
+        offset = getsize(part) if entry is not None else 0
+
+        request_headers = dict(headers or {})
+        if offset > 0:
+            request_headers['Range'] = 'bytes=%d-' % offset
+            # the server answers with the whole content if it changed since the partial download
+            request_headers['If-Range'] = entry['validator']
+        elif self.segments > 1:
+            # the first segment is asked for right away, smaller contents are sent whole
+            request_headers['Range'] = 'bytes=0-%d' % (max(1, self.segment_threshold) - 1)
+
+        try:
+            with transport.open(url, request_headers) as response:
+                if response.status == 304:
+                    response.read()
+                    return response
+
+                if response.status == 206:
+                    first, last, total = content_range(response)
+                    if first != offset:
+                        raise IOError('%s: got a range starting at %d instead of %d' % (url, first, offset))
+                else:
+                    offset = 0
+                    total = int(response.getheader('Content-Length') or -1)
+                    last = total - 1
+
+                validator = response.getheader('ETag') or response.getheader('Last-Modified')
+                if validator:
+                    self._write_journal(url, validator)
+
+                if transfer is not None:
+                    transfer.start(total, offset)
+
+                if offset == 0 and validator and 0 <= last + 1 < total:
+                    with self.connections(url, self.segments - 1) as connections:
+                        if connections > 0:
+                            try:
+                                with open(part, 'wb') as f:
+                                    retrieve_segments(transport, url, response, f, total, connections, transfer)
+                            except BaseException:
+                                # a file with holes cannot be resumed
+                                self.discard(url)
+                                raise
+
+                            if digest is not None:
+                                _feed(digest, part, transport.buffer_size)
+                            return response
+
+                with open(part, 'ab' if offset > 0 else 'wb') as f:
+                    if offset > 0 and digest is not None:
+                        _feed(digest, part, transport.buffer_size)
+                    transport.copy(response, f, transfer, digest)
+
+            if response.status == 206 and offset == 0 and last + 1 != total:
+                # only the first segment was sent, but the rest cannot be fetched in parallel
+                # or no other connection is allowed, the connection of the first one is free again
+                self._retrieve_rest(transport, url, last + 1, validator, transfer, digest)
+            return response
+        except TransportError as e:
+            if e.status != 416 or offset == 0:
+                raise
+            if digest is not None and e.response is not None and unsatisfied_range_length(e.response) == offset:
+                # the part was complete but not committed yet, the checksum tells whether it is still current
+                if transfer is not None:
+                    transfer.start(offset, offset)
+                _feed(digest, part, transport.buffer_size)
+                return e.response
+            # the partial download does not match the remote content anymore
+            self.discard(url)
+            return self.retrieve(transport, url, transfer, digest, headers)
+        except BaseException:
+            if self._journal(url) is None:
+                self.discard(url)
+            raise
+
+
+def download(transport, name, url, target, validate=False, progress=None, headers=None, staging=None,
+             expected=None):
+    """
+    Downloads url to target, reporting to progress (see progress.Progress) under the given name if any.
+    If staging (see PartialDownloads) is given, the content is received there first and can be resumed.
+    """
+    if staging is None:
+        return _download(transport, name, url, target, validate, progress, headers, staging, expected)
+
+    with staging.locked(url):
+        return _download(transport, name, url, target, validate, progress, headers, staging, expected)
+
+
+def _read_checksum(transport, url):
+    """
+    Returns the hash published next to url. A file without one cannot be trusted, so the
+    repository is treated as serving a corrupted file rather than as missing it.
+    """
+    try:
+        return parse_checksum(transport.read(url + '.sha1'))
+    except TransportError as e:
+        if e.status not in (404, 410):
+            raise
+        raise ChecksumNotFoundError(e.url) from e
+
+
+def _download(transport, name, url, target, validate, progress, headers, staging, expected):
+    transfer = progress.transfer(name) if progress is not None else None
+
+    # a known checksum spares the request for the .sha1 file
+    validate = validate or expected is not None
+    digest = hashlib.sha1() if validate else None
+
+    try:
+        if staging is None:
+            response = transport.retrieve(url, target, transfer, digest=digest, headers=headers)
+        else:
+            response = staging.retrieve(transport, url, transfer, digest=digest, headers=headers)
+    except BaseException:
+        if transfer is not None:
+            progress.discard(transfer)
+        raise
+
+    if response.status == 304:
+        if transfer is not None:
+            progress.discard(transfer)
+        return response
+
+    if transfer is not None:
+        progress.finish(transfer)
+
+    # the content has been hashed while it was written, only the expected hash is left to fetch
+    if validate:
+        try:
+            verify(digest.hexdigest(), expected or _read_checksum(transport, url))
+        except ChecksumNotMatchingError:
+            if staging is not None:
+                staging.discard(url)
+            raise
+
+    if staging is not None:
+        staging.commit(url, target)
+
+    return response
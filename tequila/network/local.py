@@ -0,0 +1,232 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import fcntl
+import os
+import re
+import shutil
+import time
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from os.path import join, dirname, exists, expanduser
+
+from ..util import write_atomically
+
+METADATA_FILE = 'maven-metadata-local.xml'
+# what maven knows of a snapshot in a remote repository, by repository id
+REMOTE_METADATA_FILE = 'maven-metadata-%s.xml'
+
+
+def _timestamp():
+    return time.strftime('%Y%m%d%H%M%S', time.gmtime())
+
+
+def _write_file(target, file):
+    """
+    Writes the content of file, given as a path or as a file object, to target.
+    """
+    if isinstance(file, str):
+        with open(file, 'rb') as src:
+            write_atomically(target, lambda f: shutil.copyfileobj(src, f), mode='wb')
+    else:
+        file.seek(0)
+        write_atomically(target, lambda f: shutil.copyfileobj(file, f), mode='wb')
+
+
+def _write_tree(target, root):
+    write_atomically(target, lambda f: ET.ElementTree(root).write(f, encoding='UTF-8', xml_declaration=True),
+                     mode='wb')
+
+
+def _child(parent, tag, text=None):
+    element = ET.SubElement(parent, tag)
+    element.text = text
+    return element
+
+
+@contextmanager
+def _locked_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def generate_pom(artifact):
+    project = ET.Element('project')
+    _child(project, 'modelVersion', '4.0.0')
+    _child(project, 'groupId', artifact.groupid)
+    _child(project, 'artifactId', artifact.artifactid)
+    _child(project, 'version', artifact.version)
+    _child(project, 'packaging', 'jar')
+    _child(project, 'description', 'POM was created by Tequila')
+    return project
+
+
+class LocalRepository(object):
+    """
+    Installs artifacts in a local maven repository, following the same layout
+    as the maven-install-plugin so that maven itself can use the result.
+    """
+
+    def __init__(self, root=None):
+        self.root = expanduser(root or '~/.m2/repository')
+
+    def path(self, artifact, packaging='jar'):
+        return join(self.root, artifact.get_uri(packaging=packaging))
+
+    def contains(self, artifact):
+        return exists(self.path(artifact))
+
+    def install(self, file, artifact, pom=None):
+        jar_path = self.path(artifact)
+        pom_path = self.path(artifact, packaging='pom')
+        os.makedirs(dirname(jar_path), 0o755, exist_ok=True)
+
+        _write_file(jar_path, file)
+
+        if pom is not None:
+            self.install_pom(pom, artifact)
+            return
+
+        if not exists(pom_path):
+            _write_tree(pom_path, generate_pom(artifact))
+        self.update_metadata(artifact)
+
+    def install_pom(self, pom, artifact):
+        pom_path = self.path(artifact, packaging='pom')
+        os.makedirs(dirname(pom_path), 0o755, exist_ok=True)
+
+        _write_file(pom_path, pom)
+        self.update_metadata(artifact)
+
+    def update_metadata(self, artifact):
+        artifact_dir = dirname(dirname(self.path(artifact)))
+        now = _timestamp()
+
+        # the directory lock keeps concurrent tequila processes from losing versions
+        with _locked_directory(artifact_dir):
+            self._update_artifact_metadata(join(artifact_dir, METADATA_FILE), artifact, now)
+            if artifact.is_snapshot():
+                self._write_snapshot_metadata(join(artifact_dir, artifact.version, METADATA_FILE), artifact, now)
+
+    def record_snapshot(self, artifact, repository_id, snapshot, timestamped=True):
+        """
+        Records which build of a snapshot was downloaded from a remote repository,
+        in the maven-metadata-<repository id>.xml file maven keeps next to it for the same purpose.
+        Unless the repository names its files after their build, they keep the -SNAPSHOT version.
+        """
+        version = artifact.version.replace('SNAPSHOT', '%s-%s' % (snapshot.timestamp, snapshot.build_number))
+        now = _timestamp()
+
+        metadata = ET.Element('metadata', modelVersion='1.1.0')
+        _child(metadata, 'groupId', artifact.groupid)
+        _child(metadata, 'artifactId', artifact.artifactid)
+        _child(metadata, 'version', artifact.version)
+
+        versioning = _child(metadata, 'versioning')
+        build = _child(versioning, 'snapshot')
+        _child(build, 'timestamp', snapshot.timestamp)
+        _child(build, 'buildNumber', snapshot.build_number)
+        _child(versioning, 'lastUpdated', now)
+
+        if timestamped:
+            snapshot_versions = _child(versioning, 'snapshotVersions')
+            for extension in ('jar', 'pom'):
+                snapshot_version = _child(snapshot_versions, 'snapshotVersion')
+                _child(snapshot_version, 'extension', extension)
+                _child(snapshot_version, 'value', version)
+                _child(snapshot_version, 'updated', now)
+
+        _write_tree(join(dirname(self.path(artifact)), REMOTE_METADATA_FILE % repository_id), metadata)
+
+    def remote_metadata(self, artifact):
+        """
+        Returns the (repository id, path) of the remote metadata kept for a snapshot, most recently written first.
+        """
+        directory = dirname(self.path(artifact))
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+
+        files = []
+        for name in names:
+            match = re.match(r'maven-metadata-(.+)\.xml$', name)
+            if match is not None and name != METADATA_FILE:
+                path = join(directory, name)
+                files.append((os.stat(path).st_mtime_ns, match.group(1), path))
+        return [(repository_id, path) for (_, repository_id, path) in sorted(files, reverse=True)]
+
+    @staticmethod
+    def _update_artifact_metadata(file, artifact, now):
+        try:
+            metadata = ET.parse(file).getroot()
+        except (IOError, ET.ParseError):
+            metadata = ET.Element('metadata')
+            _child(metadata, 'groupId', artifact.groupid)
+            _child(metadata, 'artifactId', artifact.artifactid)
+
+        versioning = metadata.find('versioning')
+        if versioning is None:
+            versioning = _child(metadata, 'versioning')
+
+        versions = versioning.find('versions')
+        if versions is None:
+            versions = _child(versioning, 'versions')
+
+        if artifact.version not in [v.text for v in versions.findall('version')]:
+            _child(versions, 'version', artifact.version)
+
+        if not artifact.is_snapshot():
+            release = versioning.find('release')
+            if release is None:
+                release = ET.Element('release')
+                versioning.insert(0, release)
+            release.text = artifact.version
+
+        last_updated = versioning.find('lastUpdated')
+        if last_updated is None:
+            last_updated = _child(versioning, 'lastUpdated')
+        last_updated.text = now
+
+        _write_tree(file, metadata)
+
+    @staticmethod
+    def _write_snapshot_metadata(file, artifact, now):
+        metadata = ET.Element('metadata', modelVersion='1.1.0')
+        _child(metadata, 'groupId', artifact.groupid)
+        _child(metadata, 'artifactId', artifact.artifactid)
+        _child(metadata, 'version', artifact.version)
+
+        versioning = _child(metadata, 'versioning')
+        snapshot = _child(versioning, 'snapshot')
+        _child(snapshot, 'localCopy', 'true')
+        _child(versioning, 'lastUpdated', now)
+
+        snapshot_versions = _child(versioning, 'snapshotVersions')
+        for extension in ('jar', 'pom'):
+            snapshot_version = _child(snapshot_versions, 'snapshotVersion')
+            _child(snapshot_version, 'extension', extension)
+            _child(snapshot_version, 'value', artifact.version)
+            _child(snapshot_version, 'updated', now)
+
+        _write_tree(file, metadata)
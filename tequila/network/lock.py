@@ -0,0 +1,133 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+
+from .maven import Artifact, Pin, SnapshotVersion
+from ..util import dump_json
+
+LOCK_VERSION = 1
+
+SERVER = 'server'
+PLUGIN = 'plugin'
+LIBRARY = 'library'
+
+
+class LockEntry(object):
+
+    def __init__(self, role, artifact, pin):
+        self.role = role
+        self.artifact = artifact
+        self.pin = pin
+
+    @property
+    def key(self):
+        return self.role, self.artifact.name, self.artifact.filename
+
+    def to_dict(self):
+        snapshot = self.pin.snapshot
+        return {
+            'role': self.role,
+            'artifact': self.artifact.name,
+            'filename': self.artifact.filename,
+            'repository': self.pin.repository,
+            'timestamp': snapshot.timestamp if snapshot is not None else None,
+            'build-number': snapshot.build_number if snapshot is not None else None,
+            'sha1': self.pin.sha1
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        artifact = Artifact.from_string(data['artifact'])
+        artifact.filename = data['filename']
+
+        snapshot = None
+        if data.get('timestamp') and data.get('build-number'):
+            snapshot = SnapshotVersion(data['timestamp'], data['build-number'])
+
+        return cls(data['role'], artifact, Pin(data.get('repository'), snapshot, data['sha1']))
+
+
+class Lockfile(object):
+    """
+    Records the exact artifacts a server was deployed with, so that later deploys
+    can reuse them without resolving anything as long as the configuration is unchanged.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.transitive = False
+        self.entries = []
+
+    def load(self):
+        """
+        Loads the lock, returning False if there is none or if it cannot be read.
+        """
+        try:
+            with open(self.file, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != LOCK_VERSION:
+                return False
+
+            self.transitive = data.get('transitive-dependencies', False)
+            self.entries = [LockEntry.from_dict(entry) for entry in data['artifacts']]
+        except (IOError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def save(self):
+        data = {
+            'version': LOCK_VERSION,
+            'transitive-dependencies': self.transitive,
+            'artifacts': [entry.to_dict() for entry in self.entries]
+        }
+        dump_json(self.file, data, indent=2, sort_keys=True)
+
+    @staticmethod
+    def _roots(server, plugins):
+        return [LockEntry(SERVER, server, None)] + [LockEntry(PLUGIN, plugin, None) for plugin in plugins]
+
+    def matches(self, server, plugins, transitive):
+        """
+        Tells whether the lock was written for the given server and plugins.
+        """
+        roots = sorted(entry.key for entry in self._roots(server, plugins))
+        locked = sorted(entry.key for entry in self.entries if entry.role != LIBRARY)
+        return roots == locked and self.transitive == transitive
+
+    def get(self, role, artifact):
+        for entry in self.entries:
+            if entry.key == (role, artifact.name, artifact.filename):
+                return entry
+        return None
+
+    def pinned(self):
+        return [(entry.artifact, entry.pin) for entry in self.entries]
+
+    def update(self, resolver, server, plugins, libraries, transitive):
+        """
+        Pins the artifacts that have just been resolved.
+        """
+        entries = self._roots(server, plugins) + [LockEntry(LIBRARY, library, None) for library in libraries]
+        for entry in entries:
+            previous = self.get(entry.role, entry.artifact)
+            entry.pin = resolver.pin(entry.artifact, previous.pin if previous is not None else None)
+
+        self.entries = entries
+        self.transitive = transitive
@@ -18,14 +18,32 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import logging
+import os
+import posixpath
+import shutil
 import subprocess
+import threading
 import xml.etree.cElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from http.client import HTTPException
+from os.path import expanduser, exists
 from string import Template
-from urllib.request import FancyURLopener
 
-from ..exception import TequilaException, UnhandledException
+from ..exception import TequilaException
 from ..util import copy
-from . import download
+from .cache import MetadataCache, MissCache, RepositoryStats
+from .download import download, ChecksumNotMatchingError, DigestCache, PartialDownloads
+from .local import LocalRepository
+from .plugin import read_plugin_meta, YamlError
+from .progress import create_progress, MODES as PROGRESS_MODES
+from .throttle import TokenBucket, parse_rate
+from .pom import Pom, EffectivePom, excluded
+from .transport import Transport, TransportError
+
+
+# plugins smaller than this are kept in memory while they are read
+PLUGIN_SPOOL_SIZE = 16 * 1024 * 1024
 
 
 class MavenMetadata(object):
@@ -42,6 +60,43 @@ class MavenMetadata(object):
     def get_snapshot_timestamp(self):
         return self.tree.findtext('./versioning/snapshot/timestamp')
 
+    def get_snapshot_version(self):
+        if self.is_unique():
+            return None
+        return SnapshotVersion(self.get_snapshot_timestamp(), self.get_snapshot_build_number())
+
+    def get_snapshot_build(self):
+        """
+        Returns the latest build of the snapshot, even if its files are not named after it.
+        """
+        timestamp, build_number = self.get_snapshot_timestamp(), self.get_snapshot_build_number()
+        if not timestamp or not build_number:
+            return None
+        return SnapshotVersion(timestamp, build_number)
+
+
+class SnapshotVersion(object):
+    """
+    A concrete build of a snapshot artifact.
+    """
+
+    def __init__(self, timestamp, build_number):
+        self.timestamp = timestamp
+        self.build_number = build_number
+
+    def get_snapshot_timestamp(self):
+        return self.timestamp
+
+    def get_snapshot_build_number(self):
+        return self.build_number
+
+    def __eq__(self, other):
+        return isinstance(other, SnapshotVersion) \
+            and (self.timestamp, self.build_number) == (other.timestamp, other.build_number)
+
+    def __hash__(self):
+        return hash((self.timestamp, self.build_number))
+
 
 class Artifact(object):
 
@@ -82,9 +137,52 @@ class Artifact(object):
 
 
 class Repository(object):
-    def __init__(self, name, url):
+    def __init__(self, name, url, max_connections=0, bandwidth=0):
         self.name = name
         self.url = url
+        self.max_connections = max_connections
+        # bytes per second, 0 for unlimited
+        self.bandwidth = bandwidth
+
+    @classmethod
+    def from_string(cls, name, value):
+        """
+        Constructs a repository from an url optionally followed by its limits,
+        e.g. "http://repo.example.org/ bandwidth=1M max-connections=2"
+        """
+        fields = value.split()
+        if len(fields) == 0:
+            raise InvalidRepositoryException(name, 'no url given')
+
+        repository = cls(name, fields[0])
+        for option in fields[1:]:
+            key, _, val = option.partition('=')
+            try:
+                if key == 'bandwidth':
+                    repository.bandwidth = parse_rate(val)
+                elif key == 'max-connections':
+                    repository.max_connections = int(val)
+                else:
+                    raise InvalidRepositoryException(name, 'unknown option %s' % key)
+            except ValueError as e:
+                raise InvalidRepositoryException(name, str(e)) from e
+        return repository
+
+
+class Pin(object):
+    """
+    Where an artifact was resolved from and what it contained at that time.
+    """
+
+    def __init__(self, repository, snapshot, sha1):
+        self.repository = repository
+        self.snapshot = snapshot
+        self.sha1 = sha1
+
+
+class InvalidRepositoryException(TequilaException):
+    def __init__(self, name, reason):
+        super().__init__('Invalid repository %s: %s' % (name, reason))
 
 
 class ArtifactUnresolvedException(TequilaException):
@@ -92,6 +190,7 @@ class ArtifactUnresolvedException(TequilaException):
         super().__init__('Could not resolve the following artifacts: %s, '
                          'please check your configuration.'
                          % [artifact.name for artifact in unresolved])
+        self.unresolved = unresolved
 
 
 class NotAPluginException(TequilaException):
@@ -104,158 +203,751 @@ class InvalidPluginMetaException(TequilaException):
         super().__init__("The downloaded plugin has an invalid plugin.yml")
 
 
+class PluginsNotInstalledException(TequilaException):
+    def __init__(self, urls):
+        super().__init__('Could not install the plugins from the following urls: %s' % ', '.join(urls))
+        self.urls = urls
+
+
 class ArtifactResolver(object):
-    def __init__(self):
+    def __init__(self, config=None):
+        if config is None:
+            from tequila import Tequila
+            config = Tequila().config
+
         self.artifacts = []
         self.repositories = []
         self.logger = logging.getLogger("ArtifactResolver")
 
+        self.concurrency = max(1, config.get_resolver_concurrency())
+        self.repository_connections = max(1, config.get_repository_connections())
+        self.buffer_size = max(1024, config.get_buffer_size())
+        # limits shared by all the repositories, 0 for unlimited
+        self.max_connections = max(0, config.get_max_connections())
+        try:
+            self.bandwidth = parse_rate(config.get_bandwidth())
+        except ValueError as e:
+            self.logger.warning('%s, downloads are not limited', e)
+            self.bandwidth = 0
+        self.use_maven = config.uses_maven()
+        self.local = LocalRepository(config.get_local_repository())
+        self.metadata_cache = MetadataCache(expanduser(config.get_cache_directory()), config.get_metadata_ttl())
+        self.miss_cache = MissCache(expanduser(config.get_cache_directory()), config.get_miss_ttl())
+        self.partial_downloads = PartialDownloads(expanduser(config.get_cache_directory()),
+                                                  segments=max(1, config.get_download_segments()),
+                                                  segment_threshold=config.get_segment_threshold(),
+                                                  connections=self._extra_slots)
+        self.repository_stats = RepositoryStats(expanduser(config.get_cache_directory()))
+        self.adaptive_order = config.uses_adaptive_order()
+        self.race = config.races_repositories()
+        # only resolve from the local repository
+        self.offline = config.is_offline()
+        # deployed files are copied as they are when there is no store
+        self.store = None
+        self.progress_mode = config.get_progress_mode()
+        if self.progress_mode not in PROGRESS_MODES:
+            self.logger.warning('Unknown progress mode %s, expected one of %s',
+                                self.progress_mode, ', '.join(PROGRESS_MODES))
+            self.progress_mode = 'auto'
+        # progress of the downloads of the current session
+        self.progress = None
+
+        # ignore cached metadata and repository misses
+        self.refresh = False
+        # look for newer builds of the snapshots already in the local repository
+        self.update_snapshots = False
+
+        # repository url and snapshot build each artifact was downloaded from
+        self.resolutions = {}
+
+        # digests of the artifacts of the local repository, which pins and the store both need
+        self.digests = DigestCache(self.buffer_size)
+
+        self._install_lock = threading.Lock()
+        self._repository_slots = {}
+        self._connection_slots = None
+        self._buckets = {}
+        self._skipped = set()
+        self._executor = None
+        self._race_executor = None
+        self._transport = None
+
+        # effective poms, memoized for the lifetime of the resolver
+        self._poms = {}
+        self._pom_locks = {}
+        self._poms_lock = threading.Lock()
+
     def enqueue(self, artifact):
         self.logger.info('Added artifact %s', artifact.name)
         self.artifacts.append(artifact)
 
-    def _try_download_artifact(self, urlopener, artifact, repository):
+    @staticmethod
+    def _metadata_uri(artifact, repository):
+        return posixpath.join(posixpath.dirname(repository.url + artifact.jar), 'maven-metadata.xml')
+
+    def _is_artifact_file(self, url, artifact, repository):
+        """
+        Tells whether url is the metadata, the jar or the pom of an artifact in a repository,
+        the only files whose absence means the repository does not have the artifact.
+        """
+        if url in (self._metadata_uri(artifact, repository), repository.url + artifact.jar,
+                   repository.url + artifact.pom):
+            return True
+
+        # the files of a unique snapshot are named after the build
+        directory, name = posixpath.split(url)
+        return artifact.is_snapshot() and directory == posixpath.dirname(repository.url + artifact.jar) \
+            and name.startswith(artifact.artifactid + '-') and name.endswith(('.jar', '.pom'))
+
+    def _repository_of(self, url):
+        repositories = [repo for repo in self.repositories if url.startswith(repo.url)]
+        if len(repositories) == 0:
+            return None
+        return max(repositories, key=lambda repo: len(repo.url))
+
+    def _observe(self, url, latency, status):
+        repository = self._repository_of(url)
+        if repository is None:
+            return
+
+        # a missing artifact is a perfectly healthy answer
+        self.repository_stats.record(repository, latency, status is not None and status < 500)
+
+    def _throttle(self, url):
+        repository = self._repository_of(url)
+        buckets = [self._buckets.get(repository.url)] if repository is not None else []
+        return [bucket for bucket in buckets + [self._buckets.get(None)] if bucket is not None]
+
+    def _slots(self, repository):
+        slots = [self._connection_slots, self._repository_slots.get(repository.url) if repository is not None else None]
+        return [slot for slot in slots if slot is not None]
+
+    @contextmanager
+    def _slot(self, repository):
+        """
+        Waits until a download from the repository, None for urls outside of the repositories,
+        is allowed by the connection limits.
+        """
+        slots = self._slots(repository)
+        for slot in slots:
+            slot.acquire()
+        try:
+            yield
+        finally:
+            for slot in reversed(slots):
+                slot.release()
+
+    @staticmethod
+    def _try_acquire(slots):
+        acquired = []
+        for slot in slots:
+            if not slot.acquire(blocking=False):
+                for taken in reversed(acquired):
+                    taken.release()
+                return False
+            acquired.append(slot)
+        return True
+
+    @contextmanager
+    def _extra_slots(self, url, wanted):
+        """
+        Takes as many of the wanted slots for more connections to url as are free, and yields how many were taken.
+        The download asking for them already holds a slot, waiting for more could deadlock the workers.
+        """
+        slots = self._slots(self._repository_of(url))
+        taken = 0
+        while taken < wanted and self._try_acquire(slots):
+            taken += 1
+        try:
+            yield taken
+        finally:
+            for _ in range(taken):
+                for slot in reversed(slots):
+                    slot.release()
+
+    def _race(self, transport, artifact, candidates, packaging='jar'):
+        """
+        Probes the first two candidates with a HEAD request and moves the first one to answer
+        positively to the front. The other request is not waited for.
+        The file probed is the first one a download of the given packaging asks for.
+        """
+        def probe(repo):
+            if artifact.is_snapshot():
+                uri = self._metadata_uri(artifact, repo)
+            else:
+                uri = artifact.get_uri(base=repo.url, packaging=packaging)
+            with self._slot(repo), transport.open(uri, method='HEAD') as response:
+                response.read()
+            return repo
+
+        contenders = dict((self._race_executor.submit(probe, repo), repo) for repo in candidates[:2])
+        missing = []
+
+        pending = set(contenders)
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    winner = contenders[future]
+                    return [winner] + [repo for repo in candidates if repo is not winner and repo not in missing]
+
+                if isinstance(error, TransportError) and error.status in (404, 410):
+                    self.miss_cache.record_miss(contenders[future], artifact)
+                    missing.append(contenders[future])
+
+        return [repo for repo in candidates if repo not in missing]
+
+    def _fetch_metadata(self, transport, artifact, url, revalidate=False):
+        """
+        Returns the path to the metadata at url, and whether it was taken from the cache without any request.
+        """
+        entry = self.metadata_cache.get(url)
+        if entry is not None and entry.is_fresh(self.metadata_cache.ttl) and not (self.refresh or revalidate):
+            return entry.file, True
+
+        tmp = self.metadata_cache.temporary_file()
+        try:
+            response = download(transport, artifact.name + ':metadata', url, tmp, validate=True,
+                                progress=self.progress, headers=entry.conditional_headers() if entry is not None else None)
+
+            if response.status == 304:
+                return self.metadata_cache.touch(entry).file, False
+            return self.metadata_cache.store(url, tmp, response).file, False
+        finally:
+            if exists(tmp):
+                os.remove(tmp)
+
+    def _snapshot_version(self, transport, artifact, repository, revalidate=False):
+        if not artifact.is_snapshot():
+            return None, None, False
+
+        meta_uri = self._metadata_uri(artifact, repository)
+        file, cached = self._fetch_metadata(transport, artifact, meta_uri, revalidate)
+        metadata = MavenMetadata(file)
+        return metadata.get_snapshot_version(), metadata.get_snapshot_build(), cached
+
+    def _with_snapshot_version(self, transport, artifact, repository, fetch):
+        """
+        Calls fetch with the snapshot version the files of the artifact are named after and its latest build
+        in the repository, both None for releases.
+        A build named by cached metadata may have been purged from the repository since, so the
+        metadata is revalidated and fetch is called once more if it is missing.
+        """
+        snapshot, build, cached = self._snapshot_version(transport, artifact, repository)
+        try:
+            return fetch(snapshot, build)
+        except TransportError as e:
+            if not cached or e.status not in (404, 410):
+                raise
+
+        self.logger.debug('Cached metadata of %s in %s is out of date', artifact.name, repository.name)
+        snapshot, build, _ = self._snapshot_version(transport, artifact, repository, revalidate=True)
+        return fetch(snapshot, build)
+
+    def _try_download_pom(self, transport, artifact, repository):
         from tempfile import mkdtemp
         from shutil import rmtree
         from os.path import join
-        import posixpath
+
+        def fetch(snapshot, build):
+            pom_uri = artifact.get_uri(base=repository.url, packaging='pom', meta=snapshot)
+            download(transport, artifact.name + ':pom', pom_uri, pom, validate=True, progress=self.progress)
 
         tmp = mkdtemp("tequila")
         try:
-            jar = join(tmp, artifact.filename)
             pom = join(tmp, artifact.filename + '.pom')
+            self._with_snapshot_version(transport, artifact, repository, fetch)
+            with self._install_lock:
+                self.local.install_pom(pom, artifact)
+        finally:
+            rmtree(tmp)
 
-            jar_uri = artifact.get_uri(base=repository.url)
-            pom_uri = artifact.get_uri(base=repository.url, packaging='pom')
-
-            if artifact.is_snapshot():
-                meta_uri = posixpath.join(posixpath.dirname(repository.url + artifact.jar), 'maven-metadata.xml')
-                meta_file = join(tmp, 'maven-metadata.xml')
+    def _try_download_artifact(self, transport, artifact, repository, pin=None):
+        from tempfile import mkdtemp
+        from shutil import rmtree
+        from os.path import join
 
-                download(urlopener, artifact.name + ':metadata', meta_uri, meta_file, validate=True)
-                meta = MavenMetadata(meta_file)
+        def fetch(snapshot, build):
+            if pin is None and build is not None and self.local.contains(artifact) \
+                    and self._recorded_build(artifact) == (repository.name, build):
+                # the latest build is the one already in the local repository
+                self.resolutions[artifact.name] = (repository.url, snapshot)
+                return
 
-                if not meta.is_unique():
-                    jar_uri = artifact.get_uri(base=repository.url, meta=meta)
-                    pom_uri = artifact.get_uri(base=repository.url, packaging='pom', meta=meta)
+            jar_uri = artifact.get_uri(base=repository.url, meta=snapshot)
+            pom_uri = artifact.get_uri(base=repository.url, packaging='pom', meta=snapshot)
 
-            download(urlopener, artifact.name + ':jar', jar_uri, jar, validate=True)
+            download(transport, artifact.name + ':jar', jar_uri, jar, validate=True, progress=self.progress,
+                     staging=self.partial_downloads, expected=pin.sha1 if pin is not None else None)
 
             try:
-                download(urlopener, artifact.name + ':pom', pom_uri, pom, validate=True)
+                download(transport, artifact.name + ':pom', pom_uri, pom, validate=True, progress=self.progress)
             except:
-                self.install_with_meta(jar, artifact)
+                with self._install_lock:
+                    self.install_with_meta(jar, artifact)
+            else:
+                with self._install_lock:
+                    self.install_with_pom(jar, pom, artifact)
+
+            if build is not None and repository in self.repositories:
+                with self._install_lock:
+                    self.local.record_snapshot(artifact, repository.name, build, timestamped=snapshot is not None)
+            self.resolutions[artifact.name] = (repository.url, snapshot)
+
+        tmp = mkdtemp("tequila")
+        try:
+            jar = join(tmp, artifact.filename)
+            pom = join(tmp, artifact.filename + '.pom')
+
+            if pin is None:
+                self._with_snapshot_version(transport, artifact, repository, fetch)
             else:
-                self.install_with_pom(jar, pom)
+                fetch(pin.snapshot, pin.snapshot)
         finally:
             rmtree(tmp)
-            pass
 
-    def _download_artifact(self, urlopener, artifact):
-        from os.path import expanduser, exists
-        if exists(expanduser('~/.m2/repository/') + artifact.jar):
+    def _download_artifact(self, transport, artifact, pom_only=False):
+        if pom_only and exists(self.local.path(artifact, packaging='pom')):
             return True
+        if not pom_only and self.local.contains(artifact) \
+                and not (self.update_snapshots and artifact.is_snapshot() and not self.offline):
+            return True
+
+        if self.offline:
+            return False
+
+        try_download = self._try_download_pom if pom_only else self._try_download_artifact
 
-        for repo in self.repositories:
+        candidates = self.candidate_repositories(artifact)
+        if self.race and len(candidates) > 1:
+            candidates = self._race(transport, artifact, candidates, 'pom' if pom_only else 'jar')
+
+        for repo in candidates:
             try:
-                self._try_download_artifact(urlopener, artifact, repo)
+                with self._slot(repo):
+                    try_download(transport, artifact, repo)
+                self.logger.info('Resolved artifact %s from %s', artifact.name, repo.name)
+                self.miss_cache.record_hit(repo, artifact)
                 return True
-            except (IOError, ValueError):
+            except TransportError as e:
+                if e.status in (404, 410) and self._is_artifact_file(e.url, artifact, repo):
+                    self.miss_cache.record_miss(repo, artifact)
+                continue
+            except ChecksumNotMatchingError as e:
+                self.logger.warning('Artifact %s from %s is corrupted: %s', artifact.name, repo.name, e.message)
+                continue
+            except (IOError, ValueError, HTTPException):
                 continue
         return False
 
-    def resolve(self):
-        urlopener = FancyURLopener()
+    def candidate_repositories(self, artifact):
+        """
+        Lists the repositories to look for an artifact in: the one which provided it last comes first,
+        followed by the others from the fastest and most reliable to the slowest, if adaptive ordering is enabled.
+        Those known not to have the artifact are skipped unless refresh is set.
+        """
+        repositories = self.repositories
+        if self.adaptive_order:
+            repositories = sorted(repositories, key=self.repository_stats.score)
+
+        if self.refresh:
+            return list(repositories)
+
+        candidates = [repo for repo in repositories if not self.miss_cache.missed(repo, artifact)]
+        skipped = len(self.repositories) - len(candidates)
+        if skipped > 0:
+            self.logger.debug('Skipping %d repositories known not to have %s', skipped, artifact.name)
+            self._skipped.add(artifact.name)
+
+        preferred = self.miss_cache.preferred(artifact)
+        return sorted(candidates, key=lambda repo: repo.url != preferred)
+
+    @contextmanager
+    def _session(self):
+        """
+        Sets up the state shared by the workers of a resolution and yields the transport to use.
+        """
+        self._repository_slots = dict((repo.url, threading.BoundedSemaphore(
+            repo.max_connections or self.repository_connections)) for repo in self.repositories)
+        self._connection_slots = threading.BoundedSemaphore(self.max_connections) if self.max_connections else None
+
+        # the global bucket is stored under None
+        self._buckets = dict((repo.url, TokenBucket(repo.bandwidth)) for repo in self.repositories if repo.bandwidth)
+        if self.bandwidth:
+            self._buckets[None] = TokenBucket(self.bandwidth)
+
+        # connections are kept alive and shared by all workers
+        transport = Transport(buffer_size=self.buffer_size, max_idle=self.concurrency, observer=self._observe,
+                              throttle=self._throttle)
+        self.miss_cache.load()
+        self.repository_stats.load()
+
+        self._transport = transport
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        if self.race:
+            self._race_executor = ThreadPoolExecutor(max_workers=2 * self.concurrency)
+
+        # downloads only count bytes, the progress is drawn at a fixed rate by its own thread
+        self.progress = create_progress(self.progress_mode)
+
         try:
-            unresolved = []
-            for artifact in self.artifacts:
-                if not self._download_artifact(urlopener, artifact):
-                    unresolved.append(artifact)
-                    self.logger.error("Could not resolve artifact %s." % artifact.name)
-
-            if len(unresolved) > 0:
-                raise ArtifactUnresolvedException(unresolved)
-        except KeyboardInterrupt as e:
-            raise TequilaException('Download interrupted by user.') from e
+            with self.progress:
+                yield transport
         finally:
-            urlopener.close()
+            self.progress = None
+            self._transport = None
+            self._executor.shutdown(wait=False)
+            if self._race_executor is not None:
+                self._race_executor.shutdown(wait=False)
+            transport.close()
+            self.miss_cache.save()
+            self.repository_stats.save()
+
+    def _run(self, function, items):
+        futures = [self._executor.submit(function, item) for item in items]
+        try:
+            # results are gathered in queue order, so the summary does not depend on scheduling
+            return [future.result() for future in futures]
+        except BaseException as e:
+            for future in futures:
+                future.cancel()
+            # the downloads in progress would otherwise hold the exit until they complete
+            self._transport.cancel()
+            if isinstance(e, KeyboardInterrupt):
+                raise TequilaException('Download interrupted by user.') from e
+            raise
+
+    def _report(self, artifacts, resolved):
+        unresolved = [artifact for (artifact, ok) in zip(artifacts, resolved) if not ok]
+        for artifact in unresolved:
+            self.logger.error("Could not resolve artifact %s." % artifact.name)
+
+        if len(unresolved) > 0 and self.offline:
+            self.logger.info('Offline mode is enabled, only %s was searched.', self.local.root)
+
+        if any(artifact.name in self._skipped for artifact in unresolved):
+            self.logger.info('Repositories that recently did not have an artifact were skipped, '
+                             'use --refresh to look again.')
+
+        if len(unresolved) > 0:
+            raise ArtifactUnresolvedException(unresolved)
 
-    def deploy(self, directory):
-        for artifact in self.artifacts:
-            self.deploy_artifact(artifact, directory, True)
+    def resolve(self):
+        with self._session() as transport:
+            resolved = self._run(lambda artifact: self._download_artifact(transport, artifact), self.artifacts)
+        self._report(self.artifacts, resolved)
+
+    def load_pom(self, transport, groupid, artifactid, version):
+        """
+        Returns the effective pom of an artifact, fetching it and its parents if they are not installed yet.
+        Poms are memoized, so that parents shared by several artifacts are only fetched and parsed once.
+        """
+        key = (groupid, artifactid, version)
+        with self._poms_lock:
+            lock = self._pom_locks.setdefault(key, threading.Lock())
+
+        with lock:
+            if key in self._poms:
+                return self._poms[key]
+
+            artifact = Artifact(groupid, artifactid, version)
+            if not self._download_artifact(transport, artifact, pom_only=True):
+                raise ArtifactUnresolvedException([artifact])
+
+            pom = Pom(self.local.path(artifact, packaging='pom'))
+            parent = self.load_pom(transport, *pom.parent) if pom.parent is not None else None
+            effective = EffectivePom(pom, parent, imports=lambda g, a, v: self.load_pom(transport, g, a, v))
+
+            self._poms[key] = effective
+            return effective
+
+    def _try_load_pom(self, transport, artifact):
+        try:
+            return self.load_pom(transport, artifact.groupid, artifact.artifactid, artifact.version)
+        except (TequilaException, IOError, ValueError, SyntaxError) as e:
+            self.logger.error('Could not read the dependencies of %s: %s', artifact.name,
+                              e.message if isinstance(e, TequilaException) else e)
+            return None
+
+    def _walk_dependencies(self, transport, roots):
+        """
+        Returns the dependencies of the roots, and the artifacts whose pom could not be read.
+        """
+        # the roots are already deployed on their own and win over any dependency on them
+        selected = set((artifact.groupid, artifact.artifactid) for artifact in roots)
+        dependencies = []
+        unreadable = []
+
+        # each node carries the exclusions of its path and the dependency management of its root
+        level = [(artifact, frozenset(), None) for artifact in roots]
+        while len(level) > 0:
+            poms = self._run(lambda node: self._try_load_pom(transport, node[0]), level)
+
+            next_level = []
+            for (artifact, exclusions, managed), pom in zip(level, poms):
+                if pom is None:
+                    unreadable.append(artifact)
+                    continue
+                if managed is None:
+                    managed = pom.managed
+
+                for dependency in pom.runtime_dependencies():
+                    # nearest wins: the first version met while walking level by level is kept
+                    if dependency.key in selected or excluded(exclusions, *dependency.key):
+                        continue
+
+                    version = dependency.version
+                    if managed is not pom.managed and dependency.key in managed:
+                        version = managed[dependency.key].version or version
+
+                    if not version or version[0] in '[(' or '${' in version:
+                        self.logger.warning('Cannot determine which version of %s:%s to use for %s',
+                                            dependency.groupid, dependency.artifactid, artifact.name)
+                        continue
+
+                    selected.add(dependency.key)
+                    library = Artifact(dependency.groupid, dependency.artifactid, version)
+                    dependencies.append(library)
+                    next_level.append((library, exclusions | dependency.exclusions, managed))
+
+            level = next_level
+
+        return dependencies, unreadable
+
+    def resolve_dependencies(self, artifacts):
+        """
+        Resolves the runtime dependencies of already resolved artifacts, walking their dependency graph
+        one level at a time with the poms of a level fetched in parallel.
+        Returns the dependencies, which are resolved as well.
+        """
+        with self._session() as transport:
+            dependencies, unreadable = self._walk_dependencies(transport, artifacts)
+            # the dependencies of an artifact are unknown as long as its pom cannot be read
+            self._report(unreadable, [False] * len(unreadable))
+
+            resolved = self._run(lambda artifact: self._download_artifact(transport, artifact), dependencies)
+
+        for library in dependencies:
+            self.logger.info('Added dependency %s', library.name)
+        self._report(dependencies, resolved)
+        return dependencies
 
     @staticmethod
-    def deploy_artifact(artifact, target, directory=False):
-        from os.path import join, expanduser
-        copy(expanduser('~/.m2/repository/') + artifact.jar, join(target, artifact.filename) if directory else target)
+    def _read_metadata(file):
+        try:
+            return MavenMetadata(file)
+        except (IOError, SyntaxError):
+            return None
 
-    def install_external_jar(self, urlopener, artifact, url):
-        from os.path import join
-        from tempfile import mkdtemp
-        from shutil import rmtree
+    def _recorded_metadata(self, artifact):
+        """
+        Returns the name of the repository the snapshot in the local repository was downloaded from
+        and the metadata recorded with it, or None.
+        """
+        for (repository_id, file) in self.local.remote_metadata(artifact):
+            metadata = self._read_metadata(file)
+            if metadata is not None and metadata.get_snapshot_build() is not None:
+                return repository_id, metadata
+        return None
 
-        tmp = mkdtemp("tequila")
+    def _recorded_build(self, artifact):
+        recorded = self._recorded_metadata(artifact)
+        return (recorded[0], recorded[1].get_snapshot_build()) if recorded is not None else None
+
+    def _installed_from(self, artifact):
+        """
+        Returns the url of the repository an artifact of the local repository was downloaded from and its
+        snapshot build, as recorded by the local repository or, failing that, by the metadata cache.
+        """
+        preferred = self.miss_cache.preferred(artifact)
+        if not artifact.is_snapshot():
+            return preferred, None
+
+        recorded = self._recorded_metadata(artifact)
+        if recorded is not None:
+            urls = [repo.url for repo in self.repositories if repo.name == recorded[0]]
+            return urls[0] if len(urls) > 0 else preferred, recorded[1].get_snapshot_version()
+
+        # snapshots downloaded before their builds were recorded
+        if preferred is not None:
+            entry = self.metadata_cache.get(self._metadata_uri(artifact, Repository(preferred, preferred)))
+            metadata = self._read_metadata(entry.file) if entry is not None else None
+            if metadata is not None:
+                return preferred, metadata.get_snapshot_version()
+        return preferred, None
+
+    def pin(self, artifact, previous=None):
+        """
+        Returns the pin of a resolved artifact. What the previous pin knows is kept if the artifact
+        did not change and was not downloaded again.
+        """
+        sha1 = self.digests.sha1(self.local.path(artifact))
+        if artifact.name in self.resolutions:
+            repository, snapshot = self.resolutions[artifact.name]
+            return Pin(repository, snapshot, sha1)
+
+        repository, snapshot = self._installed_from(artifact)
+        if previous is not None and previous.sha1 == sha1:
+            repository, snapshot = previous.repository or repository, previous.snapshot or snapshot
+        return Pin(repository, snapshot, sha1)
+
+    def _fetch_pinned(self, transport, artifact, pin):
+        path = self.local.path(artifact)
+        if exists(path) and self.digests.sha1(path) == pin.sha1:
+            return True
+
+        if self.offline:
+            self.logger.error('The pinned build of %s is not in %s', artifact.name, self.local.root)
+            return False
+
+        if pin.repository is None:
+            self.logger.error('The lock does not record where %s comes from', artifact.name)
+            return False
+
+        # the configured repository knows its name, under which the build is recorded in the local repository
+        configured = [repo for repo in self.repositories if repo.url == pin.repository]
+        repository = configured[0] if len(configured) > 0 else Repository(pin.repository, pin.repository)
         try:
-            jar = join(tmp, 'jar')
+            with self._slot(repository):
+                self._try_download_artifact(transport, artifact, repository, pin)
+        except (TequilaException, IOError, ValueError, HTTPException) as e:
+            self.logger.error('Could not fetch %s from %s: %s', artifact.name, pin.repository,
+                              e.message if isinstance(e, TequilaException) else e)
+            return False
 
-            download(urlopener, artifact.name + ':jar', url, jar, validate=False)
-            self.install_with_meta(jar, artifact)
-        finally:
-            rmtree(tmp, ignore_errors=True)
-            pass
+        self.logger.info('Resolved artifact %s from %s', artifact.name, pin.repository)
+        return True
 
-    def install_plugin_jar(self, urlopener, url):
+    def fetch_pinned(self, pinned):
+        """
+        Makes sure the local repository holds the exact builds given as (artifact, pin) pairs.
+        Builds that are missing are fetched straight from the repository they are pinned to,
+        without any metadata lookup.
+        """
+        with self._session() as transport:
+            fetched = self._run(lambda entry: self._fetch_pinned(transport, *entry), pinned)
+
+        unresolved = [artifact for ((artifact, _), ok) in zip(pinned, fetched) if not ok]
+        if len(unresolved) > 0:
+            if not self.offline:
+                self.logger.info('Use tequila update to resolve the artifacts again.')
+            raise ArtifactUnresolvedException(unresolved)
+
+    def deploy(self, directory):
+        for artifact in self.artifacts:
+            self.deploy_artifact(artifact, directory, True)
+
+    def deploy_artifact(self, artifact, target, directory=False):
         from os.path import join
-        from tempfile import mkdtemp
-        from shutil import rmtree
+        target = join(target, artifact.filename) if directory else target
+
+        if self.store is None:
+            copy(self.local.path(artifact), target)
+        else:
+            self.store.deploy(self.local.path(artifact), target)
+
+    def fetch_plugin_jar(self, transport, url):
+        """
+        Downloads a plugin jar into a spooled temporary file and returns it
+        along with the artifact described by its plugin.yml.
+        """
+        from tempfile import SpooledTemporaryFile
         import zipfile
-        import io
 
-        tmp = mkdtemp("tequila")
+        jar = SpooledTemporaryFile(max_size=PLUGIN_SPOOL_SIZE)
+        transfer = self.progress.transfer(url) if self.progress is not None else None
         try:
-            jar = join(tmp, 'jar')
-
-            download(urlopener, url.split('/')[-1], url, jar, validate=False)
-
-            with zipfile.ZipFile(jar, 'r') as jar_file:
-
-                artifact_id = None
-                version = None
-                group_id = None
-                try:
-                    with jar_file.open('plugin.yml', 'rU') as plugin_meta:
-                        wrapper = io.TextIOWrapper(plugin_meta)
-                        for line in wrapper:
-                            if line.startswith('name:') and artifact_id is None:
-                                artifact_id = line.split(':', 1)[1].strip()
-                            if line.startswith('version:') and version is None:
-                                version = line.split(':', 1)[1].strip()
-                            if line.startswith('main:') and group_id is None:
-                                main = line.split(':', 1)[1].strip()
-                                group_id = '.'.join(main.split('.', 2)[:2])
-                            if artifact_id is not None and version is not None and group_id is not None:
-                                break
-                except Exception as e:
-                    raise UnhandledException() from e
-                    #raise NotAPluginException()
-
-                if artifact_id is None and version is None and group_id is None:
-                    raise InvalidPluginMetaException()
-
-                self.install_with_meta(jar, Artifact(group_id, artifact_id, version))
+            with self._slot(self._repository_of(url)), transport.open(url) as response:
+                if transfer is not None:
+                    transfer.start(int(response.getheader('Content-Length') or -1))
+                transport.copy(response, jar, transfer)
+            if transfer is not None:
+                self.progress.finish(transfer)
+            jar.seek(0)
+
+            try:
+                meta = read_plugin_meta(jar)
+            except zipfile.BadZipFile as e:
+                raise NotAPluginException() from e
+            except YamlError as e:
+                raise InvalidPluginMetaException() from e
+
+            if meta is None:
+                raise NotAPluginException()
+
+            artifact_id, version, main = meta.get('name'), meta.get('version'), meta.get('main')
+            if not all(isinstance(value, str) and value for value in (artifact_id, version, main)):
+                raise InvalidPluginMetaException()
+
+            group_id = '.'.join(main.split('.', 2)[:2])
+            return Artifact(group_id, artifact_id, version), jar
+        except:
+            if transfer is not None:
+                self.progress.discard(transfer)
+            jar.close()
+            raise
+
+    def _try_fetch_plugin_jar(self, transport, url):
+        try:
+            return self.fetch_plugin_jar(transport, url)
+        except (TequilaException, IOError, ValueError, HTTPException) as e:
+            self.logger.error('Could not download %s: %s', url, e.message if isinstance(e, TequilaException) else e)
+            return None
+
+    def install_plugin_jars(self, urls):
+        """
+        Downloads plugin jars concurrently, then installs all of them in the local repository in one pass.
+        Returns the installed artifacts.
+        """
+        with self._session() as transport:
+            fetched = self._run(lambda url: self._try_fetch_plugin_jar(transport, url), urls)
+
+        installed = []
+        try:
+            with self._install_lock:
+                for (artifact, jar) in [result for result in fetched if result is not None]:
+                    self.install_with_meta(jar, artifact)
+                    installed.append(artifact)
         finally:
-            rmtree(tmp, ignore_errors=True)
-            pass
+            for result in fetched:
+                if result is not None:
+                    result[1].close()
+
+        failed = [url for (url, result) in zip(urls, fetched) if result is None]
+        if len(failed) > 0:
+            raise PluginsNotInstalledException(failed)
+        return installed
+
+    def install_with_pom(self, file, pom, artifact):
+        self.logger.info('Installing artifact %s...', artifact.name)
+        if not self.use_maven:
+            self.local.install(file, artifact, pom)
+            return
 
-    def install_with_pom(self, file, pom):
-        self.logger.info('Installing artifact...')
         subprocess.call(['mvn', '-q', 'install:install-file',
+                         '-Dmaven.repo.local=%s' % self.local.root,
                          '-Dfile=%s' % file,
                          '-DpomFile=%s' % pom])
 
     def install_with_meta(self, file, artifact):
-        self.logger.info('Installing artifact...')
+        self.logger.info('Installing artifact %s...', artifact.name)
+        if not self.use_maven:
+            self.local.install(file, artifact)
+            return
+
+        if not isinstance(file, str):
+            # maven can only install files from the filesystem
+            from tempfile import NamedTemporaryFile
+            with NamedTemporaryFile(suffix='.jar') as f:
+                file.seek(0)
+                shutil.copyfileobj(file, f)
+                f.flush()
+                self.install_with_meta(f.name, artifact)
+            return
+
         subprocess.call(['mvn', '-q', 'install:install-file',
+                         '-Dmaven.repo.local=%s' % self.local.root,
                          '-Dfile=%s' % file,
                          '-Dpackaging=jar',
                          '-DgroupId=%s' % artifact.groupid,
@@ -0,0 +1,324 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import zipfile
+
+PLUGIN_META = 'plugin.yml'
+# what identifies a plugin, the rest of its description is not needed to resolve it
+PLUGIN_KEYS = ('name', 'main', 'version')
+
+DOUBLE_QUOTED_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0', '"': '"', '\\': '\\', '/': '/', ' ': ' '}
+
+
+class YamlError(ValueError):
+    def __init__(self, line, message):
+        super().__init__('line %d: %s' % (line, message))
+        self.line = line
+
+
+class _Line(object):
+    def __init__(self, number, indent, text):
+        self.number = number
+        self.indent = indent
+        self.text = text
+
+
+def _strip_comment(text):
+    quote = None
+    escaped = False
+    for (i, c) in enumerate(text):
+        if escaped:
+            escaped = False
+        elif quote is not None:
+            # quotes are escaped by doubling them in single-quoted strings, with a backslash in double-quoted ones
+            if c == quote and quote == '\'' and text[i + 1:i + 2] == '\'':
+                escaped = True
+            elif c == '\\' and quote == '"':
+                escaped = True
+            elif c == quote:
+                quote = None
+        elif c in '\'"' and (i == 0 or text[i - 1] in ' \t:[{,-'):
+            quote = c
+        elif c == '#' and (i == 0 or text[i - 1] in ' \t'):
+            return text[:i].rstrip()
+    return text.rstrip()
+
+
+def _split_flow(text, number):
+    items = []
+    depth = 0
+    quote = None
+    start = 0
+    for (i, c) in enumerate(text):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '[{':
+            depth += 1
+        elif c in ']}':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            items.append(text[start:i].strip())
+            start = i + 1
+
+    if quote is not None or depth != 0:
+        raise YamlError(number, 'unterminated flow collection')
+
+    last = text[start:].strip()
+    if last or items:
+        items.append(last)
+    return [item for item in items if item]
+
+
+def _find_colon(text):
+    """
+    Returns the position of the colon separating a key from its value, -1 if there is none.
+    """
+    quote = None
+    for (i, c) in enumerate(text):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in '\'"' and i == 0:
+            quote = c
+        elif c == ':' and (i + 1 == len(text) or text[i + 1] in ' \t'):
+            return i
+    return -1
+
+
+def _scalar(text, number):
+    """
+    Parses an inline value. Plain scalars are kept as strings, so that versions such as 1.10 are not mangled.
+    """
+    if not text or text == '~' or text == 'null':
+        return None
+
+    if text[0] == '"':
+        if len(text) < 2 or text[-1] != '"':
+            raise YamlError(number, 'unterminated string')
+        result = []
+        chars = iter(text[1:-1])
+        for c in chars:
+            if c == '\\':
+                escaped = next(chars, '')
+                if escaped == 'u':
+                    result.append(chr(int(''.join(next(chars, '') for _ in range(4)), 16)))
+                else:
+                    result.append(DOUBLE_QUOTED_ESCAPES.get(escaped, '\\' + escaped))
+            else:
+                result.append(c)
+        return ''.join(result)
+
+    if text[0] == '\'':
+        if len(text) < 2 or text[-1] != '\'':
+            raise YamlError(number, 'unterminated string')
+        return text[1:-1].replace('\'\'', '\'')
+
+    if text[0] == '[':
+        if text[-1] != ']':
+            raise YamlError(number, 'unterminated flow sequence')
+        return [_scalar(item, number) for item in _split_flow(text[1:-1], number)]
+
+    if text[0] == '{':
+        if text[-1] != '}':
+            raise YamlError(number, 'unterminated flow mapping')
+        mapping = {}
+        for item in _split_flow(text[1:-1], number):
+            colon = _find_colon(item)
+            if colon < 0:
+                mapping[_scalar(item, number)] = None
+            else:
+                mapping[_scalar(item[:colon].strip(), number)] = _scalar(item[colon + 1:].strip(), number)
+        return mapping
+
+    return text
+
+
+class _Parser(object):
+
+    def __init__(self, text):
+        self.raw = text.replace('\t', '    ').splitlines()
+        self.lines = []
+        for (number, raw) in enumerate(self.raw, 1):
+            if raw.strip() in ('---', '...'):
+                continue
+            text = _strip_comment(raw)
+            if text.strip():
+                self.lines.append(_Line(number, len(text) - len(text.lstrip()), text.strip()))
+        self.position = 0
+
+    def peek(self):
+        return self.lines[self.position] if self.position < len(self.lines) else None
+
+    def block_scalar(self, style, parent_indent, number):
+        """
+        Reads a literal (|) or folded (>) block scalar from the raw lines following line number.
+        """
+        collected = []
+        indent = None
+        i = number
+        while i < len(self.raw):
+            raw = self.raw[i]
+            if raw.strip():
+                current = len(raw) - len(raw.lstrip())
+                if current <= parent_indent:
+                    break
+                if indent is None:
+                    indent = current
+                collected.append(raw[min(indent, current):])
+            else:
+                collected.append('')
+            i += 1
+
+        # skip the lines that were consumed
+        while self.peek() is not None and self.peek().number <= i:
+            self.position += 1
+
+        while collected and not collected[-1]:
+            collected.pop()
+
+        if style.startswith('>'):
+            return ' '.join(line if line else '\n' for line in collected).replace(' \n ', '\n') + '\n'
+        return '\n'.join(collected) + '\n'
+
+    def continuation(self, text, indent):
+        """
+        Joins text with the lines indented deeper than its key that follow, over which
+        plain, quoted and flow values may be wrapped. Line breaks are folded into spaces.
+        """
+        lines = [text]
+        while self.peek() is not None and self.peek().indent > indent:
+            lines.append(self.peek().text)
+            self.position += 1
+        return ' '.join(lines)
+
+    def value(self, text, indent, number):
+        if text.startswith('|') or text.startswith('>'):
+            return self.block_scalar(text, indent, number)
+        if text:
+            return _scalar(self.continuation(text, indent), number)
+
+        following = self.peek()
+        if following is None:
+            return None
+        # sequences may be written at the indentation of their key
+        if following.indent > indent or (following.indent == indent and following.text.startswith('-')):
+            return self.block(following.indent)
+        return None
+
+    def block(self, indent):
+        first = self.peek()
+        if first.text == '-' or first.text.startswith('- '):
+            return self.sequence(indent)
+        return self.mapping(indent)
+
+    def sequence(self, indent):
+        items = []
+        while True:
+            line = self.peek()
+            if line is None or line.indent != indent or not (line.text == '-' or line.text.startswith('- ')):
+                break
+            self.position += 1
+
+            text = line.text[1:].strip()
+            if _find_colon(text) > 0 and text[0] not in '\'"[{':
+                # a mapping starting on the same line as its dash
+                inner = indent + len(line.text) - len(line.text[1:].lstrip())
+                self.lines.insert(self.position, _Line(line.number, inner, text))
+                items.append(self.mapping(inner))
+            else:
+                items.append(self.value(text, indent, line.number))
+        return items
+
+    def mapping(self, indent):
+        mapping = {}
+        while True:
+            line = self.peek()
+            if line is None or line.indent < indent:
+                break
+            if line.indent > indent:
+                raise YamlError(line.number, 'unexpected indentation')
+            if line.text.startswith('- '):
+                break
+
+            colon = _find_colon(line.text)
+            if colon < 0:
+                raise YamlError(line.number, 'expected a key')
+            self.position += 1
+
+            key = _scalar(line.text[:colon].strip(), line.number)
+            mapping[key] = self.value(line.text[colon + 1:].strip(), indent, line.number)
+        return mapping
+
+    def parse(self):
+        if self.peek() is None:
+            return None
+        document = self.block(self.peek().indent)
+        if self.peek() is not None:
+            raise YamlError(self.peek().number, 'unexpected content')
+        return document
+
+
+def parse_yaml(text):
+    """
+    Parses the subset of YAML used by plugin descriptions: block mappings and sequences,
+    flow collections, quoted and plain scalars, block scalars and comments.
+    Anchors, tags and multiple documents are not supported.
+    """
+    return _Parser(text).parse()
+
+
+def _read_top_level_keys(text, keys):
+    """
+    Reads the given unindented keys with inline values, ignoring the rest of the document.
+    """
+    values = {}
+    for (number, raw) in enumerate(text.splitlines(), 1):
+        if not raw or raw[0] in ' \t#-':
+            continue
+        line = _strip_comment(raw)
+        colon = _find_colon(line)
+        key = line[:colon].strip() if colon > 0 else None
+        if key in keys and key not in values:
+            values[key] = _scalar(line[colon + 1:].strip(), number)
+    return values
+
+
+def read_plugin_meta(jar):
+    """
+    Returns the parsed plugin.yml of a jar, given as a path or a file object, None if there is none.
+    """
+    with zipfile.ZipFile(jar, 'r') as jar_file:
+        try:
+            data = jar_file.read(PLUGIN_META)
+        except KeyError:
+            return None
+
+    text = data.decode('utf-8-sig', errors='replace')
+    try:
+        meta = parse_yaml(text)
+    except YamlError:
+        # descriptions using YAML this parser does not support still name their plugin plainly
+        meta = _read_top_level_keys(text, PLUGIN_KEYS)
+        if len(meta) < len(PLUGIN_KEYS):
+            raise
+    if not isinstance(meta, dict):
+        raise YamlError(1, 'expected a mapping')
+    return meta
@@ -0,0 +1,190 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import xml.etree.ElementTree as ET
+
+# scopes of the dependencies needed at runtime
+RUNTIME_SCOPES = ('compile', 'runtime')
+
+PROPERTY = re.compile(r'\$\{([^}]+)\}')
+
+
+def _strip_namespaces(root):
+    for element in root.iter():
+        if isinstance(element.tag, str) and '}' in element.tag:
+            element.tag = element.tag.split('}', 1)[1]
+    return root
+
+
+def excluded(exclusions, groupid, artifactid):
+    for (excluded_groupid, excluded_artifactid) in exclusions:
+        if excluded_groupid in ('*', groupid) and excluded_artifactid in ('*', artifactid):
+            return True
+    return False
+
+
+def _text(element, path, default=None):
+    text = element.findtext(path) if element is not None else None
+    return text.strip() if text is not None else default
+
+
+class Dependency(object):
+
+    def __init__(self, groupid, artifactid, version=None, scope=None, type='jar',
+                 classifier=None, optional=False, exclusions=()):
+        self.groupid = groupid
+        self.artifactid = artifactid
+        self.version = version
+        self.scope = scope
+        self.type = type
+        self.classifier = classifier
+        self.optional = optional
+        self.exclusions = frozenset(exclusions)
+
+    @property
+    def key(self):
+        return self.groupid, self.artifactid
+
+    def interpolate(self, properties):
+        def substitute(value):
+            if value is None:
+                return None
+            return PROPERTY.sub(lambda m: properties.get(m.group(1), m.group(0)), value)
+
+        return Dependency(substitute(self.groupid), substitute(self.artifactid), substitute(self.version),
+                          substitute(self.scope), substitute(self.type), substitute(self.classifier),
+                          self.optional, [(substitute(g), substitute(a)) for (g, a) in self.exclusions])
+
+    @classmethod
+    def from_element(cls, element):
+        exclusions = [(_text(e, 'groupId', '*'), _text(e, 'artifactId', '*'))
+                      for e in element.findall('exclusions/exclusion')]
+
+        return cls(_text(element, 'groupId'),
+                   _text(element, 'artifactId'),
+                   _text(element, 'version'),
+                   _text(element, 'scope'),
+                   _text(element, 'type', 'jar'),
+                   _text(element, 'classifier'),
+                   _text(element, 'optional', 'false') == 'true',
+                   exclusions)
+
+
+class Pom(object):
+    """
+    The raw content of a pom file, before inheritance and interpolation.
+    """
+
+    def __init__(self, file):
+        root = _strip_namespaces(ET.parse(file).getroot())
+
+        parent = root.find('parent')
+        self.parent = None
+        if parent is not None:
+            self.parent = (_text(parent, 'groupId'), _text(parent, 'artifactId'), _text(parent, 'version'))
+
+        self.groupid = _text(root, 'groupId', self.parent[0] if self.parent else None)
+        self.artifactid = _text(root, 'artifactId')
+        self.version = _text(root, 'version', self.parent[2] if self.parent else None)
+        self.packaging = _text(root, 'packaging', 'jar')
+
+        properties = root.find('properties')
+        self.properties = dict((p.tag, (p.text or '').strip()) for p in properties) \
+            if properties is not None else {}
+
+        self.managed = [Dependency.from_element(d) for d in root.findall('dependencyManagement/dependencies/dependency')]
+        self.dependencies = [Dependency.from_element(d) for d in root.findall('dependencies/dependency')]
+
+
+class EffectivePom(object):
+    """
+    A pom merged with its parents, with its properties interpolated and its dependency management applied.
+    """
+
+    def __init__(self, pom, parent=None, imports=lambda groupid, artifactid, version: None):
+        self.groupid = pom.groupid
+        self.artifactid = pom.artifactid
+        self.version = pom.version
+        self.packaging = pom.packaging
+
+        self.properties = dict(parent.properties) if parent is not None else {}
+        self.properties.update(pom.properties)
+        self.properties.update({
+            'project.groupId': self.groupid,
+            'project.artifactId': self.artifactid,
+            'project.version': self.version,
+            'pom.groupId': self.groupid,
+            'pom.artifactId': self.artifactid,
+            'pom.version': self.version,
+            'version': self.version,
+        })
+        if pom.parent is not None:
+            self.properties.update({
+                'project.parent.groupId': pom.parent[0],
+                'project.parent.artifactId': pom.parent[1],
+                'project.parent.version': pom.parent[2],
+            })
+
+        # properties may refer to each other
+        for _ in range(5):
+            expanded = dict((k, self.interpolate(v)) for (k, v) in self.properties.items())
+            if expanded == self.properties:
+                break
+            self.properties = expanded
+
+        self.groupid = self.interpolate(self.groupid)
+        self.version = self.interpolate(self.version)
+
+        self.managed = dict(parent.managed) if parent is not None else {}
+        for dependency in [d.interpolate(self.properties) for d in pom.managed]:
+            if dependency.scope == 'import' and dependency.type == 'pom':
+                bom = imports(dependency.groupid, dependency.artifactid, dependency.version)
+                if bom is not None:
+                    for key, managed in bom.managed.items():
+                        self.managed.setdefault(key, managed)
+            else:
+                self.managed[dependency.key] = dependency
+
+        inherited = parent.dependencies if parent is not None else []
+        declared = [self._manage(d.interpolate(self.properties)) for d in pom.dependencies]
+        keys = set(d.key for d in declared)
+        self.dependencies = [d for d in inherited if d.key not in keys] + declared
+
+    def interpolate(self, value):
+        if value is None:
+            return None
+        return PROPERTY.sub(lambda m: self.properties.get(m.group(1), m.group(0)), value)
+
+    def _manage(self, dependency):
+        managed = self.managed.get(dependency.key)
+        if managed is None:
+            if dependency.scope is None:
+                dependency.scope = 'compile'
+            return dependency
+
+        return Dependency(dependency.groupid, dependency.artifactid,
+                          dependency.version or managed.version,
+                          dependency.scope or managed.scope or 'compile',
+                          dependency.type, dependency.classifier, dependency.optional,
+                          dependency.exclusions | managed.exclusions)
+
+    def runtime_dependencies(self):
+        return [d for d in self.dependencies
+                if d.scope in RUNTIME_SCOPES and not d.optional and d.type == 'jar' and d.classifier is None]
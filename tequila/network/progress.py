@@ -0,0 +1,373 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import logging
+import sys
+import threading
+import time
+
+from .download import bytes_to_human
+
+MODES = ('auto', 'tty', 'line', 'json', 'none')
+
+# seconds between two frames, per renderer
+TTY_INTERVAL = 0.1
+LINE_INTERVAL = 5.0
+
+
+class Transfer(object):
+    """
+    The progress of a single transfer. Downloads only bump counters, rendering is done elsewhere.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.total = -1
+        self.received = 0
+        self.started = time.time()
+        self.finished = None
+
+    def start(self, total, received=0):
+        self.total = total
+        self.received = received
+
+    def advance(self, n):
+        # segmented downloads may advance concurrently, the counter is only used for display
+        self.received += n
+
+    @property
+    def fraction(self):
+        if self.total <= 0:
+            return None
+        return min(1.0, self.received / self.total)
+
+
+def _shorten(name, size):
+    if len(name) <= size:
+        return name.ljust(size)
+    half = (size - 3) // 2
+    return name[:half] + '...' + name[-(size - 3 - half):]
+
+
+class Progress(object):
+    """
+    Tracks concurrent transfers and renders them at a fixed rate from a background thread.
+    """
+
+    def __init__(self, renderer=None, interval=TTY_INTERVAL):
+        self.renderer = renderer
+        self.interval = interval
+
+        self.active = []
+        self.completed = []
+        self.received = 0
+        self.total = 0
+
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def transfer(self, name):
+        transfer = Transfer(name)
+        with self._lock:
+            self.active.append(transfer)
+        return transfer
+
+    def finish(self, transfer):
+        transfer.finished = time.time()
+        with self._lock:
+            if transfer in self.active:
+                self.active.remove(transfer)
+                self.completed.append(transfer)
+
+    def discard(self, transfer):
+        """
+        Forgets a transfer that did not happen, such as a lookup in a repository missing the file.
+        """
+        with self._lock:
+            if transfer in self.active:
+                self.active.remove(transfer)
+
+    def snapshot(self):
+        """
+        Returns the active transfers and the transfers completed since the previous snapshot.
+        """
+        with self._lock:
+            active = list(self.active)
+            completed, self.completed = self.completed, []
+        return active, completed
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.renderer.render(self)
+
+    def __enter__(self):
+        if self.renderer is not None:
+            self.renderer.begin()
+            self._thread = threading.Thread(target=self._run, name='progress', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self.renderer.render(self)
+            self.renderer.end()
+
+
+def _swap_stream(handler, stream):
+    """
+    Makes handler write to stream and returns the stream it wrote to, as StreamHandler.setStream
+    does from Python 3.7 on.
+    """
+    handler.acquire()
+    try:
+        handler.flush()
+        previous, handler.stream = handler.stream, stream
+    finally:
+        handler.release()
+    return previous
+
+
+def _terminal_handlers():
+    """
+    Returns the log handlers writing to a terminal.
+    """
+    loggers = [logging.getLogger()] + [logger for logger in logging.Logger.manager.loggerDict.values()
+                                       if isinstance(logger, logging.Logger)]
+    handlers = []
+    for logger in loggers:
+        for handler in logger.handlers:
+            if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler) \
+                    and getattr(handler.stream, 'isatty', lambda: False)() and handler not in handlers:
+                handlers.append(handler)
+    return handlers
+
+
+class _FrameStream(object):
+    """
+    Stands for the stream of a log handler while a frame is drawn on the same terminal.
+    """
+
+    def __init__(self, renderer, stream):
+        self.renderer = renderer
+        self.stream = stream
+
+    def write(self, text):
+        self.renderer.write_above(self.stream, text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Renderer(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.received = 0
+        self.total = 0
+        self.count = 0
+        self.rate = 0.0
+        self._last = None
+
+    def begin(self):
+        pass
+
+    def end(self):
+        pass
+
+    def _account(self, active, completed):
+        """
+        Updates the aggregate counters and the transfer rate.
+        """
+        for transfer in completed:
+            self.count += 1
+            self.received += transfer.received
+            self.total += max(transfer.total, transfer.received)
+
+        received = self.received + sum(t.received for t in active)
+        total = self.total + sum(max(t.total, t.received) for t in active)
+
+        now = time.time()
+        if self._last is not None and now > self._last[0]:
+            rate = (received - self._last[1]) / (now - self._last[0])
+            self.rate += 0.5 * (rate - self.rate)
+        self._last = (now, received)
+        return received, total
+
+    def render(self, progress):
+        raise NotImplementedError
+
+
+class TerminalRenderer(Renderer):
+    """
+    Redraws an aggregate line and one line per active transfer in place.
+    """
+
+    name_size = 26
+    bar_size = 15
+    max_lines = 8
+
+    def __init__(self, stream):
+        super().__init__(stream)
+        self._lines = []
+        self._lock = threading.Lock()
+        self._handlers = []
+
+    def begin(self):
+        self.stream.write('\x1B[?25l')  # deactivate cursor
+        self.stream.flush()
+
+        # log records written in the middle of a frame would be overwritten or scrambled by the next one
+        for handler in _terminal_handlers():
+            self._handlers.append((handler, _swap_stream(handler, _FrameStream(self, handler.stream))))
+
+    def end(self):
+        for (handler, stream) in self._handlers:
+            _swap_stream(handler, stream)
+        self._handlers = []
+
+        self.stream.write('\x1B[?25h')  # activate cursor
+        self.stream.flush()
+
+    def write_above(self, stream, text):
+        """
+        Writes text to stream where the frame was, and draws the frame again below it.
+        """
+        with self._lock:
+            if self._lines:
+                self.stream.write('\x1B[%dF\x1B[J' % len(self._lines))
+                self.stream.flush()
+            stream.write(text)
+            stream.flush()
+            self.stream.write(''.join('\x1B[K%s\n' % line for line in self._lines))
+            self.stream.flush()
+
+    def _bar(self, transfer):
+        fraction = transfer.fraction
+        if fraction is None:
+            return '  %s %9s' % (_shorten(transfer.name, self.name_size), bytes_to_human(transfer.received))
+
+        filled = int(fraction * self.bar_size)
+        return '  %s [%s%s] %3d%% %9s' % (_shorten(transfer.name, self.name_size), '#' * filled,
+                                           ' ' * (self.bar_size - filled), fraction * 100,
+                                           bytes_to_human(transfer.total))
+
+    def render(self, progress):
+        active, completed = progress.snapshot()
+        received, total = self._account(active, completed)
+
+        out = []
+        for transfer in completed:
+            out.append('\x1B[KDownloaded %s (%s)\n' % (transfer.name, bytes_to_human(transfer.received)))
+
+        lines = []
+        if active:
+            lines.append('Downloading %d files: %s / %s (%s/s)' % (len(active), bytes_to_human(received),
+                                                                 bytes_to_human(total),
+                                                                 bytes_to_human(self.rate)))
+            lines += [self._bar(transfer) for transfer in active[:self.max_lines]]
+            if len(active) > self.max_lines:
+                lines.append('  and %d more' % (len(active) - self.max_lines))
+
+        out += ['\x1B[K%s\n' % line for line in lines]
+        # clear what is left of a taller previous frame
+        out.append('\x1B[J')
+
+        with self._lock:
+            # move back to the first line of the previous frame
+            if self._lines:
+                out.insert(0, '\x1B[%dF' % len(self._lines))
+            self._lines = lines
+            self.stream.write(''.join(out))
+            self.stream.flush()
+
+
+class LineRenderer(Renderer):
+    """
+    Prints completed transfers and a periodic summary line, for logs.
+    """
+
+    def render(self, progress):
+        active, completed = progress.snapshot()
+        received, total = self._account(active, completed)
+
+        for transfer in completed:
+            self.stream.write('Downloaded %s (%s in %.1fs)\n' % (transfer.name, bytes_to_human(transfer.received),
+                                                                transfer.finished - transfer.started))
+        if active:
+            self.stream.write('Downloading %d files: %s / %s (%s/s)\n' % (len(active), bytes_to_human(received),
+                                                                        bytes_to_human(total),
+                                                                        bytes_to_human(self.rate)))
+        self.stream.flush()
+
+
+class JsonRenderer(Renderer):
+    """
+    Prints one JSON object per line for every completed transfer and for every frame.
+    """
+
+    def render(self, progress):
+        active, completed = progress.snapshot()
+        received, total = self._account(active, completed)
+
+        for transfer in completed:
+            self.stream.write(json.dumps({
+                'event': 'done',
+                'name': transfer.name,
+                'bytes': transfer.received,
+                'seconds': round(transfer.finished - transfer.started, 3)
+            }) + '\n')
+
+        if active:
+            self.stream.write(json.dumps({
+                'event': 'progress',
+                'received': received,
+                'total': total,
+                'rate': int(self.rate),
+                'completed': self.count,
+                'active': [{'name': t.name, 'received': t.received, 'total': t.total} for t in active]
+            }) + '\n')
+        self.stream.flush()
+
+
+def create_progress(mode='auto', stream=None, interval=None):
+    """
+    Creates the progress tracker for a mode: tty, line, json or none.
+    The auto mode draws in place on terminals and prints lines otherwise.
+    """
+    stream = stream or sys.stdout
+    if mode not in MODES:
+        raise ValueError('Unknown progress mode %s, expected one of %s' % (mode, ', '.join(MODES)))
+
+    if mode == 'auto':
+        mode = 'tty' if stream.isatty() else 'line'
+
+    if mode == 'none':
+        return Progress()
+    if mode == 'tty':
+        return Progress(TerminalRenderer(stream), interval or TTY_INTERVAL)
+    if mode == 'json':
+        return Progress(JsonRenderer(stream), interval or LINE_INTERVAL)
+    return Progress(LineRenderer(stream), interval or LINE_INTERVAL)
@@ -0,0 +1,173 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno
+import fcntl
+import os
+import shutil
+from os.path import join, dirname, exists, samefile
+from tempfile import mkstemp
+
+from .download import DigestCache
+
+# from linux/fs.h, shares the extents of a file with another file on copy-on-write filesystems
+FICLONE = 0x40049409
+
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+COPY = 'copy'
+
+METHODS = (HARDLINK, REFLINK, COPY)
+
+# servers run as different users, the members of the group of the store may all add to it,
+# and what they add belongs to that group
+STORE_DIRECTORY_MODE = 0o2775
+
+
+def _temporary_path(directory):
+    fd, tmp = mkstemp(dir=directory, prefix='.tequila')
+    os.close(fd)
+    os.remove(tmp)
+    return tmp
+
+
+def _makedirs(directory, mode):
+    """
+    Creates directory and its missing parents with the given mode, regardless of the umask.
+    """
+    if exists(directory):
+        return
+    _makedirs(dirname(directory), mode)
+    try:
+        os.mkdir(directory)
+        os.chmod(directory, mode)
+    except FileExistsError:
+        pass
+
+
+def _hardlink(src, dst):
+    os.link(src, dst)
+
+
+def _reflink(src, dst):
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def _copy(src, dst):
+    shutil.copyfile(src, dst)
+
+
+_LINKERS = {
+    HARDLINK: _hardlink,
+    REFLINK: _reflink,
+    COPY: _copy,
+}
+
+
+class ArtifactStore(object):
+    """
+    Keeps a single read-only copy of every deployed file, named after its SHA-1, and places
+    files in server directories as hard links or reflinks to it, so that servers running the same
+    jars share their disk space and page cache. Copies are only made when the store and the
+    server are on different filesystems, or if the filesystem supports neither.
+    Users who may not add to the store keep the files it lacks in their own store, at fallback.
+    """
+
+    def __init__(self, root, method=HARDLINK, fallback=None, digests=None):
+        if method not in METHODS:
+            raise ValueError('Unknown deploy method %s, expected one of %s' % (method, ', '.join(METHODS)))
+
+        self.root = root
+        self.fallback = fallback
+        # the preferred method comes first, copying always comes last
+        self.methods = list(METHODS[METHODS.index(method):])
+
+        # digests of the files added during this run
+        self.digests = digests or DigestCache()
+
+    def path(self, digest, root=None):
+        return join(root or self.root, digest[:2], digest)
+
+    def add(self, file):
+        """
+        Adds a file to the store and returns its path in the store.
+        """
+        digest = self.digests.sha1(file)
+        path = self.path(digest)
+        if exists(path):
+            return path
+
+        try:
+            return self._add(file, path, STORE_DIRECTORY_MODE)
+        except PermissionError:
+            if self.fallback is None:
+                raise
+
+        path = self.path(digest, self.fallback)
+        if exists(path):
+            return path
+        return self._add(file, path, 0o755)
+
+    def _add(self, file, path, mode):
+        _makedirs(dirname(path), mode)
+        tmp = _temporary_path(dirname(path))
+        try:
+            self._place(file, tmp, [REFLINK, COPY])
+            # the stored file is shared by every server, none of them may modify it
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, path)
+        except:
+            if exists(tmp):
+                os.remove(tmp)
+            raise
+        return path
+
+    def _place(self, src, dst, methods):
+        for method in methods:
+            try:
+                _LINKERS[method](src, dst)
+                return method
+            except OSError as e:
+                if method == COPY or e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP,
+                                                     errno.EINVAL, errno.ENOTTY):
+                    raise
+
+    def deploy(self, file, target):
+        """
+        Places a file at target through the store, replacing whatever target was atomically.
+        """
+        path = self.add(file)
+        if exists(target) and samefile(path, target):
+            return
+
+        os.makedirs(dirname(target), 0o755, exist_ok=True)
+        tmp = _temporary_path(dirname(target))
+        try:
+            self._place(path, tmp, self.methods)
+            os.replace(tmp, target)
+        except:
+            if exists(tmp):
+                os.remove(tmp)
+            raise
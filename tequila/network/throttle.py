@@ -0,0 +1,64 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+import threading
+import time
+
+RATE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kKmMgG]?)i?[bB]?(?:/s)?\s*$')
+UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+
+def parse_rate(value):
+    """
+    Parses a bandwidth such as 512k or 1.5M, in bytes per second. Empty values and 0 mean unlimited.
+    """
+    if value is None or str(value).strip() == '':
+        return 0
+
+    match = RATE.match(str(value))
+    if match is None:
+        raise ValueError('Invalid bandwidth: %s' % value)
+    return int(float(match.group(1)) * UNITS[match.group(2).lower()])
+
+
+class TokenBucket(object):
+    """
+    Limits the rate at which bytes flow through it, allowing bursts of up to one second worth of bytes.
+    Readers take tokens after reading and sleep off any debt, so that a single
+    lock acquisition is needed per buffer and concurrent readers share the rate fairly.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if delay > 0:
+            time.sleep(delay)
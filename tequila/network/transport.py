@@ -0,0 +1,312 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import http.client
+import socket
+import threading
+import time
+from base64 import b64encode
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urljoin, unquote
+from urllib.request import getproxies, proxy_bypass_environment
+
+USER_AGENT = 'Tequila'
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+# errors raised when a kept-alive connection has been closed by the remote end
+STALE_CONNECTION_ERRORS = (http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
+
+class TransportError(IOError):
+    def __init__(self, url, status, reason, response=None):
+        super().__init__('%s: HTTP %d %s' % (url, status, reason))
+        self.url = url
+        self.status = status
+        self.reason = reason
+        # the error response, already read, for its headers
+        self.response = response
+
+
+class TransferCancelledError(IOError):
+    def __init__(self):
+        super().__init__('Transfer cancelled')
+
+
+class Transport(object):
+    """
+    Issues HTTP requests over persistent connections, keeping idle connections
+    per (scheme, host, port) so that consecutive requests to the same
+    repository do not pay for a new TCP (and TLS) handshake.
+    Instances are safe to share between threads.
+    Requests go through the proxies of the environment (http_proxy, https_proxy and no_proxy)
+    unless proxies are given, as a dict of proxy urls by scheme in the format of urllib.request.getproxies.
+    """
+
+    def __init__(self, buffer_size=64 * 1024, timeout=30, max_idle=4, max_redirects=5, observer=None, throttle=None,
+                 proxies=None):
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_redirects = max_redirects
+
+        # called with (url, seconds until the response headers, status or None on failure)
+        self.observer = observer
+        # called with an url, returns the token buckets its content is read through
+        self.throttle = throttle
+        self.proxies = getproxies() if proxies is None else proxies
+
+        self._idle = {}
+        # connections with a response being read
+        self._active = set()
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split(url):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('Unsupported url scheme: %s' % url)
+
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        return (parts.scheme, parts.hostname, port), path
+
+    def _proxy(self, key):
+        """
+        Returns the (host, port, headers) of the proxy to reach a server through, or None to connect directly.
+        """
+        scheme, host, port = key
+        proxy = self.proxies.get(scheme)
+        if not proxy or proxy_bypass_environment('%s:%d' % (host, port), self.proxies):
+            return None
+
+        if '://' not in proxy:
+            proxy = 'http://' + proxy
+        parts = urlsplit(proxy)
+
+        headers = {}
+        if parts.username is not None:
+            credentials = '%s:%s' % (unquote(parts.username), unquote(parts.password or ''))
+            headers['Proxy-Authorization'] = 'Basic ' + b64encode(credentials.encode('utf-8')).decode('ascii')
+        return parts.hostname, parts.port or 80, headers
+
+    def _connect(self, key):
+        scheme, host, port = key
+        proxy = self._proxy(key)
+        if proxy is None:
+            if scheme == 'https':
+                return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+            return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+        proxy_host, proxy_port, headers = proxy
+        if scheme == 'https':
+            # the TLS session is established with the server through a CONNECT tunnel
+            connection = http.client.HTTPSConnection(proxy_host, proxy_port, timeout=self.timeout)
+            connection.set_tunnel(host, port, headers)
+            return connection
+        return http.client.HTTPConnection(proxy_host, proxy_port, timeout=self.timeout)
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _release(self, key, connection):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def _request(self, key, method, path, headers):
+        if self._cancelled.is_set():
+            raise TransferCancelledError()
+
+        scheme, host, port = key
+        proxy = self._proxy(key) if scheme == 'http' else None
+        if proxy is not None:
+            # plain http proxies are sent the absolute url of the resource
+            path = 'http://%s:%d%s' % (host, port, path)
+            headers = dict(headers, **proxy[2])
+
+        connection, reused = self._acquire(key)
+        try:
+            connection.request(method, path, headers=headers)
+            return connection, connection.getresponse()
+        except STALE_CONNECTION_ERRORS:
+            connection.close()
+            if not reused:
+                raise
+        except:
+            connection.close()
+            raise
+
+        # the idle connection went away in the meantime, try once more on a fresh one
+        connection = self._connect(key)
+        try:
+            connection.request(method, path, headers=headers)
+            return connection, connection.getresponse()
+        except:
+            connection.close()
+            raise
+
+    @contextmanager
+    def open(self, url, headers=None, method='GET'):
+        """
+        Opens an url and yields the response, following redirections.
+        Error statuses are raised as TransportError.
+        The connection is given back to the pool once the response has been read entirely.
+        """
+        all_headers = {'User-Agent': USER_AGENT}
+        all_headers.update(headers or {})
+
+        # limits are those of the requested url, wherever it redirects to
+        buckets = self.throttle(url) if self.throttle is not None else ()
+
+        for _ in range(self.max_redirects + 1):
+            key, path = self._split(url)
+            start = time.time()
+            try:
+                connection, response = self._request(key, method, path, all_headers)
+            except (IOError, http.client.HTTPException):
+                if self.observer:
+                    self.observer(url, time.time() - start, None)
+                raise
+
+            if self.observer:
+                self.observer(url, time.time() - start, response.status)
+            response.buckets = buckets
+
+            with self._lock:
+                self._active.add(connection)
+
+            redirect = None
+            try:
+                if response.status in REDIRECT_CODES and response.getheader('Location'):
+                    response.read()
+                    redirect = urljoin(url, response.getheader('Location'))
+                elif response.status >= 400:
+                    response.read()
+                    raise TransportError(url, response.status, response.reason, response)
+                else:
+                    yield response
+            except BaseException:
+                # the state of the connection is unknown
+                connection.close()
+                raise
+            finally:
+                with self._lock:
+                    self._active.discard(connection)
+
+            if response.isclosed() and not response.will_close:
+                self._release(key, connection)
+            else:
+                connection.close()
+
+            if redirect is None:
+                return
+            url = redirect
+
+        raise TransportError(url, 310, 'Too many redirections')
+
+    def read(self, url, headers=None):
+        with self.open(url, headers) as response:
+            return response.read()
+
+    def readinto(self, response, buffer):
+        """
+        Reads the body of a response opened by this transport into buffer, within the bandwidth limits of its url.
+        """
+        n = response.readinto(buffer)
+        # a cancelled read may have returned early with a truncated content
+        if self._cancelled.is_set():
+            raise TransferCancelledError()
+        for bucket in response.buckets:
+            bucket.consume(n)
+        return n
+
+    def retrieve(self, url, target, transfer=None, digest=None, headers=None):
+        """
+        Downloads an url to a file and returns the response.
+        If a progress Transfer is given, it is started with the size of the content and advanced as it is written.
+        If a hashlib object is given as digest, it is fed with the content as it is written.
+        The target is left untouched when a conditional request is answered with 304 Not Modified.
+        """
+        with self.open(url, headers) as response:
+            if response.status == 304:
+                response.read()
+                return response
+
+            if transfer is not None:
+                transfer.start(int(response.getheader('Content-Length') or -1))
+            with open(target, 'wb') as f:
+                self.copy(response, f, transfer, digest)
+            return response
+
+    def copy(self, response, f, transfer=None, digest=None):
+        total = int(response.getheader('Content-Length') or -1)
+        buffer = bytearray(self.buffer_size)
+        view = memoryview(buffer)
+
+        received = 0
+        while True:
+            n = self.readinto(response, buffer)
+            if not n:
+                break
+            received += n
+            f.write(view[:n])
+            if digest is not None:
+                digest.update(view[:n])
+            if transfer is not None:
+                transfer.advance(n)
+
+        # http.client silently stops reading when the connection is closed early
+        if 0 <= total != received:
+            raise http.client.IncompleteRead(b'', total - received)
+
+    def cancel(self):
+        """
+        Makes every request in progress or to come fail with TransferCancelledError,
+        waking up the threads blocked on a read.
+        """
+        self._cancelled.set()
+        with self._lock:
+            active = list(self._active)
+
+        for connection in active:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except (AttributeError, OSError):
+                # already closed
+                pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
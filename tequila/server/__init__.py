@@ -29,7 +29,8 @@ from .exception import \
     ServerDoesNotExistException, \
     ServerConfigurationNotFoundException, \
     ServerNotRunningException, \
-    ServerRunningException
+    ServerRunningException, \
+    InvalidPortRangeException
 from .wrapper import Wrapper
 
 from ..util import delegate, FileMatcher
@@ -84,6 +85,12 @@ class Server(Controlled):
         except Exception as e:
             raise ServerConfigurationNotFoundException(self) from e
 
+        if not self.config.has_valid_port_range():
+            raise InvalidPortRangeException(self, self.config.get_instance_port_range())
+
+        # the wrapper was picked before the configuration was known
+        self.control_interface.wrapper = Wrapper.get_wrapper(self.config.get_wrapper_type())(self, self.name)
+
         if self.config.is_version_control_enabled():
             self.config_repository = Git(self.home,
                                          filter=FileMatcher(self.config.get_version_control_config_files()))
@@ -157,6 +164,12 @@ class ServerControl(Control):
         self.wrapper.send(mc_cmd)
         self.logger.info('Sent command \'%s\'', mc_cmd)
 
+    def attach(self):
+        if not self.running():
+            raise ServerNotRunningException(self.server)
+
+        self.wrapper.attach()
+
     def status(self):
         return Template('$name: $state').substitute(
             name=self.server.name,
@@ -22,6 +22,8 @@ from .instance import InstancePolicy, BindingPolicy
 
 from ..config import Config, config_node
 
+MAX_PORT = (1 << 16) - 1
+
 
 class ServerConfig(Config):
 
@@ -44,6 +46,10 @@ class ServerConfig(Config):
     def get_user(self):
         return 'minecraft'
 
+    @config_node('transitive-dependencies', type=bool)
+    def uses_transitive_dependencies(self):
+        return False
+
     @config_node('enabled', section='version-control', type=bool)
     def is_version_control_enabled(self):
         return False
@@ -60,6 +66,10 @@ class ServerConfig(Config):
     def get_plugins_dir(self):
         return 'plugins'
 
+    @config_node('libraries', section='directories')
+    def get_libraries_dir(self):
+        return 'libs'
+
     @config_node('worlds', section='directories')
     def get_worlds_dir(self):
         return 'worlds'
@@ -88,6 +98,17 @@ class ServerConfig(Config):
     def get_instance_port_range(self):
         return [25565, 25665]
 
+    def has_valid_port_range(self):
+        """
+        Tells whether the port range is a lower and an optional upper port, in order and between 1 and 65535.
+        """
+        port_range = self.get_instance_port_range()
+        try:
+            ports = [int(port) for port in port_range]
+        except ValueError:
+            return False
+        return 1 <= len(ports) <= 2 and 1 <= ports[0] <= ports[-1] <= MAX_PORT
+
     def get_directories(self):
         return self.get_section('directories')
 
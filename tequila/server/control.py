@@ -36,6 +36,9 @@ class Control(object):
     def send(self, cmd):
         pass
 
+    def attach(self):
+        pass
+
 
 class Controlled(object):
 
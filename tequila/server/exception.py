@@ -52,4 +52,20 @@ class ServerNotRunningException(ServerException):
 
 class ServerCannotBeJoinedException(ServerException):
     def __init__(self, server):
-        super().__init__('Server $name cannot be joined', server)
\ No newline at end of file
+        super().__init__('Server $name cannot be joined', server)
+
+
+class InvalidPortRangeException(ServerException):
+    def __init__(self, server, port_range):
+        super().__init__('Server $name has an invalid port range $range, expected one or two ports from 1 to 65535',
+                         server, range=', '.join(port_range))
+
+
+class NothingStagedException(ServerException):
+    def __init__(self, server):
+        super().__init__('Server $name has no staged deploy to apply', server)
+
+
+class FleetDeployFailedException(TequilaException):
+    def __init__(self, names):
+        super().__init__('Could not deploy $names', names=', '.join(names))
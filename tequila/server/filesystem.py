@@ -17,14 +17,19 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import os
+import re
+import zipfile
 from distutils.dir_util import copy_tree, remove_tree
-from os.path import join
+from os.path import join, dirname, exists, expanduser, basename, isfile
 from subprocess import call
 
-from ..network import ArtifactResolver, Repository, Artifact
+from ..network import ArtifactResolver, ArtifactStore, Repository, Artifact, Lockfile
+from ..network.lock import SERVER, PLUGIN, LIBRARY
+from .manifest import DeploymentManifest, ManifestEntry
 from .exception import ServerAlreadyExistsException, \
     ServerDoesNotExistException, \
-    ServerRunningException
+    ServerRunningException, \
+    NothingStagedException
 
 
 def copy_server_root(target):
@@ -38,6 +43,9 @@ class ServerFilesystem(object):
         self.server = server
         self.config = server.config
         self.server_jar = join(server.home, 'server.jar')
+        self.lock_file = join(server.configuration_directory, 'tequila.lock')
+        self.manifest_file = join(server.configuration_directory, 'tequila.manifest')
+        self.staging_directory = join(server.home, '.staged')
         self.logger = server.logger
 
     def init(self, force=False, merge=False):
@@ -64,40 +72,288 @@ class ServerFilesystem(object):
     def plugin_directory(self):
         return join(self.server.home, self.server.config.get_plugins_dir())
 
-    def deploy(self):
-        if self.server.running():
-            raise ServerRunningException(self.server)
+    @property
+    def library_directory(self):
+        return join(self.server.home, self.server.config.get_libraries_dir())
 
-        resolver = ArtifactResolver()
-        resolver.repositories = [Repository(name, repo) for (name, repo) in self.config.get_repositories().items()]
+    def get_library_paths(self):
+        """
+        Returns the paths of the deployed libraries, relative to the server home.
+        """
+        manifest = DeploymentManifest(self.manifest_file)
+        manifest.load()
+        return sorted(path for (path, entry) in manifest.entries.items() if entry.role == LIBRARY)
 
-        server = Artifact.from_string(self.config.get_server_bin())
-        resolver.enqueue(server)
+    def get_main_class(self):
+        """
+        Returns the Main-Class of the manifest of the server jar, or None if it has none.
+        """
+        try:
+            with zipfile.ZipFile(self.server_jar) as jar:
+                manifest = jar.read('META-INF/MANIFEST.MF').decode('utf-8', 'replace')
+        except (IOError, KeyError, zipfile.BadZipFile):
+            return None
+
+        # long values are wrapped on lines starting with a space
+        for line in re.sub(r'\r?\n ', '', manifest).splitlines():
+            name, _, value = line.partition(':')
+            if name.strip() == 'Main-Class':
+                return value.strip() or None
+        return None
+
+    def _check_start_script(self, lock):
+        if not any(entry.role == LIBRARY for entry in lock.entries):
+            return
 
         try:
-            removed_plugins = set([f for f in os.listdir(self.plugin_directory) if f.endswith('.jar')])
-        except FileNotFoundError:
-            removed_plugins = set()
+            with open(join(self.server.home, 'start'), 'r') as f:
+                loads_libraries = '$MAIN_CLASS' in f.read()
+        except IOError:
+            return
+
+        if not loads_libraries:
+            from tequila import Tequila
+            self.logger.warning('The start script of the server runs java -jar, which does not load the libraries, '
+                                'see %s for one that does', join(Tequila().get_resource_dir(), 'server_base', 'start'))
 
+    @staticmethod
+    def create_resolver(repositories, refresh=False, update=False, offline=False):
+        from tequila import Tequila
+        tequila = Tequila()
+
+        resolver = ArtifactResolver()
+        resolver.refresh = refresh or update
+        resolver.update_snapshots = update
+        resolver.offline = resolver.offline or offline
+        resolver.store = ArtifactStore(tequila.get_store_dir(), tequila.config.get_deploy_method(),
+                                       fallback=join(expanduser(tequila.config.get_cache_directory()), 'store'),
+                                       digests=resolver.digests)
+        resolver.repositories = repositories
+        return resolver
+
+    def get_repositories(self):
+        return [Repository.from_string(name, repo) for (name, repo) in self.config.get_repositories().items()]
+
+    def get_artifacts(self):
+        """
+        Returns the server artifact and the plugin artifacts of the configuration.
+        """
+        server = Artifact.from_string(self.config.get_server_bin())
+
+        plugins = []
         for (plugin_name, plugin_url) in self.config.get_plugins().items():
             plugin = Artifact.from_string(plugin_url)
             plugin.filename = plugin_name + '.jar'
-            resolver.enqueue(plugin)
-            removed_plugins.discard(plugin.filename)
+            plugins.append(plugin)
+
+        return server, plugins
+
+    def get_pinned_lock(self, server, plugins, update=False):
+        """
+        Returns the lock if the artifacts it pins can be deployed as they are,
+        None if the configuration changed since it was written.
+        """
+        lock = Lockfile(self.lock_file)
+        if not lock.load() or update:
+            return None
+
+        if not lock.matches(server, plugins, self.config.uses_transitive_dependencies()):
+            self.logger.info('The configuration changed since the last deploy, updating %s', self.lock_file)
+            return None
+
+        self.logger.info('Using the artifacts pinned in %s', self.lock_file)
+        return lock
+
+    def lock_artifacts(self, resolver, server, plugins):
+        """
+        Pins the resolved artifacts of the server, along with their dependencies if enabled, and returns the lock.
+        """
+        transitive = self.config.uses_transitive_dependencies()
+
+        libraries = []
+        if transitive:
+            libraries = resolver.resolve_dependencies([server] + plugins)
+
+        # the previous lock knows which snapshot builds are already in the local repository
+        lock = Lockfile(self.lock_file)
+        lock.load()
+        lock.update(resolver, server, plugins, libraries, transitive)
+        lock.save()
+        return lock
+
+    def _resolve(self, resolver, server, plugins, update):
+        """
+        Makes the artifacts of the server available in the local repository and returns the lock pinning them.
+        The artifacts pinned in the lock are used as long as the configuration did not change,
+        otherwise they are resolved again and the lock is rewritten.
+        """
+        lock = self.get_pinned_lock(server, plugins, update)
+        if lock is not None:
+            resolver.fetch_pinned(lock.pinned())
+            return lock
+
+        for artifact in [server] + plugins:
+            resolver.enqueue(artifact)
         resolver.resolve()
 
-        resolver.artifacts.pop(0)
-        resolver.deploy(self.plugin_directory)
-        resolver.deploy_artifact(server, self.server_jar)
+        return self.lock_artifacts(resolver, server, plugins)
 
-        for removed in removed_plugins:
-            name = removed[:-4]
-            self.logger.info('Removing plugin %s', name)
-            os.remove(join(self.plugin_directory, removed))
-            remove_tree(join(self.plugin_directory, name), verbose=False)
+    def _targets(self, lock):
+        """
+        Maps the paths of the files to deploy, relative to the server home, to the lock entries they come from.
+        """
+        directories = {
+            LIBRARY: self.config.get_libraries_dir(),
+            PLUGIN: self.config.get_plugins_dir()
+        }
+
+        targets = {}
+        for entry in lock.entries:
+            if entry.role == SERVER:
+                path = 'server.jar'
+            else:
+                path = join(directories[entry.role], entry.artifact.filename)
+            # a plugin wins over a library with the same name
+            if path not in targets or entry.role != LIBRARY:
+                targets[path] = entry
+        return targets
+
+    def _load_manifest(self, digests=None):
+        """
+        Returns the manifest of the last deploy. A server deployed before manifests were written gets one
+        listing the jars found in its home, so that the plugins dropped since are still removed.
+        """
+        manifest = DeploymentManifest(self.manifest_file)
+        if manifest.load():
+            return manifest
+
+        found = [('server.jar', SERVER)]
+        try:
+            found += [(join(self.config.get_plugins_dir(), name), PLUGIN)
+                      for name in sorted(os.listdir(self.plugin_directory)) if name.endswith('.jar')]
+        except FileNotFoundError:
+            pass
+
+        for (path, role) in found:
+            file = join(self.server.home, path)
+            if isfile(file):
+                # with its digest, a jar that is already the one to deploy is left in place
+                digest = digests.sha1(file) if digests is not None else None
+                manifest.entries[path] = ManifestEntry.of(file, path, role, basename(path), digest)
+        return manifest
+
+    def _materialize(self, resolver, lock, root):
+        """
+        Deploys under root the files whose content differs from what the manifest says was deployed
+        in the server home, and logs the difference.
+        Returns the current manifest, the entries of the new one and the paths that are not part of the server anymore.
+        """
+        manifest = self._load_manifest(resolver.digests)
+
+        targets = self._targets(lock)
+        added, updated, unchanged = [], [], []
+        entries = {}
+
+        for (path, entry) in sorted(targets.items()):
+            previous = manifest.entries.get(path)
+            if previous is not None and previous.digest == entry.pin.sha1 \
+                    and previous.matches(join(self.server.home, path)):
+                entries[path] = previous
+                unchanged.append(path)
+                continue
+
+            file = join(root, path)
+            resolver.deploy_artifact(entry.artifact, file)
+            entries[path] = ManifestEntry.of(file, path, entry.role, entry.artifact.name, entry.pin.sha1)
+            if previous is None:
+                self.logger.info('Added %s (%s)', path, entry.artifact.name)
+                added.append(path)
+            else:
+                self.logger.info('Updated %s (%s -> %s)', path, previous.source, entry.artifact.name)
+                updated.append(path)
+
+        removed = sorted(path for path in manifest.entries if path not in targets)
+        for path in removed:
+            self.logger.info('Removed %s (%s)', path, manifest.entries[path].source)
+
+        self.logger.info('%d added, %d updated, %d removed, %d unchanged',
+                         len(added), len(updated), len(removed), len(unchanged))
+        return manifest, entries, removed
+
+    def _remove(self, manifest, removed):
+        for path in removed:
+            file = join(self.server.home, path)
+            if exists(file):
+                os.remove(file)
+            # plugins keep their data in a directory named after them
+            if manifest.entries[path].role == PLUGIN and os.path.isdir(file[:-4]):
+                remove_tree(file[:-4], verbose=False)
+
+    def _discard_staged(self):
+        if exists(self.staging_directory):
+            remove_tree(self.staging_directory, verbose=False)
+
+    def materialize(self, resolver, lock, stage=False):
+        """
+        Deploys the artifacts pinned in the lock, in the server home or in its staging directory.
+        """
+        # a staged deploy is outdated by any newer deploy
+        self._discard_staged()
+        self._check_start_script(lock)
+
+        if stage:
+            _, entries, _ = self._materialize(resolver, lock, self.staging_directory)
+            os.makedirs(self.staging_directory, 0o755, exist_ok=True)
+
+            staged = DeploymentManifest(join(self.staging_directory, 'tequila.manifest'))
+            staged.entries = entries
+            staged.save()
+            self.logger.info('Staged deploy, restart the server with --apply_staged to apply it')
+            return
+
+        manifest, entries, removed = self._materialize(resolver, lock, self.server.home)
+        self._remove(manifest, removed)
+        manifest.entries = entries
+        manifest.save()
 
         self.logger.info('Successfully deployed server')
 
+    def deploy(self, refresh=False, update=False, offline=False, stage=False):
+        if self.server.running() and not stage:
+            raise ServerRunningException(self.server)
+
+        resolver = self.create_resolver(self.get_repositories(), refresh, update, offline)
+
+        server, plugins = self.get_artifacts()
+        lock = self._resolve(resolver, server, plugins, update)
+        self.materialize(resolver, lock, stage)
+
+    def apply_staged(self):
+        """
+        Moves the files of a staged deploy in place, which only takes a rename per changed file.
+        """
+        if self.server.running():
+            raise ServerRunningException(self.server)
+
+        staged = DeploymentManifest(join(self.staging_directory, 'tequila.manifest'))
+        if not staged.load():
+            raise NothingStagedException(self.server)
+
+        manifest = self._load_manifest()
+
+        for path in sorted(staged.entries):
+            file = join(self.staging_directory, path)
+            if exists(file):
+                target = join(self.server.home, path)
+                os.makedirs(dirname(target), 0o755, exist_ok=True)
+                os.replace(file, target)
+
+        self._remove(manifest, [path for path in manifest.entries if path not in staged.entries])
+        os.replace(staged.file, self.manifest_file)
+        self._discard_staged()
+
+        self.logger.info('Applied staged deploy')
+
     def delete(self):
         if self.server.running():
             raise ServerRunningException(self.server)
@@ -0,0 +1,225 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .exception import ServerRunningException, FleetDeployFailedException
+from .filesystem import ServerFilesystem
+from ..exception import TequilaException
+from ..network import ArtifactUnresolvedException
+from ..util import get_uid
+
+
+class FleetMember(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.artifact, self.plugins = server.filesystem.get_artifacts()
+        self.lock = None
+
+    @property
+    def artifacts(self):
+        return [self.artifact] + self.plugins
+
+
+class Fleet(object):
+    """
+    Deploys several servers at once: the artifacts they have in common are resolved only once,
+    then every server is deployed in parallel. A server failing does not stop the others.
+    """
+
+    def __init__(self, servers):
+        self.servers = servers
+        self.logger = logging.getLogger('Tequila')
+        self.failed = {}
+
+    def _fail(self, server, message):
+        server.logger.error(message)
+        self.failed[server.name] = message
+
+    def _load(self, stage):
+        members = []
+        for server in self.servers:
+            try:
+                server.load(watch=False)
+                if get_uid(server.config.get_user()) != os.getuid():
+                    self._fail(server, 'Please run this command as user \'%s\'.' % server.config.get_user())
+                    continue
+                if server.running() and not stage:
+                    raise ServerRunningException(server)
+                members.append(FleetMember(server))
+            except TequilaException as e:
+                self._fail(server, e.message)
+            except Exception as e:
+                server.logger.exception(e)
+                self.failed[server.name] = str(e)
+        return members
+
+    def _repositories(self, members):
+        """
+        Returns the members whose repositories agree with those of the members before them, and the
+        repositories of these members. A name or an url defined differently by two servers is a conflict,
+        since the local repository records where snapshots came from by repository name.
+        """
+        by_name, by_url = {}, {}
+        remaining, repositories = [], []
+        for member in members:
+            try:
+                defined = member.server.filesystem.get_repositories()
+            except TequilaException as e:
+                self._fail(member.server, e.message)
+                continue
+
+            conflicts = set()
+            for repository in defined:
+                definition = (repository.name, repository.url, repository.max_connections, repository.bandwidth)
+                if by_name.get(repository.name, definition) != definition \
+                        or by_url.get(repository.url, definition) != definition:
+                    conflicts.add(repository.name)
+
+            if len(conflicts) > 0:
+                self._fail(member.server, 'Other servers define repository %s differently, '
+                                          'deploy this server on its own' % ', '.join(sorted(conflicts)))
+                continue
+
+            for repository in defined:
+                if repository.name not in by_name:
+                    definition = (repository.name, repository.url, repository.max_connections, repository.bandwidth)
+                    by_name[repository.name] = by_url[repository.url] = definition
+                    repositories.append(repository)
+            remaining.append(member)
+        return remaining, repositories
+
+    def _discard_unresolved(self, members, error):
+        """
+        Fails the members needing one of the artifacts that could not be resolved and returns the others.
+        """
+        unresolved = set(artifact.name for artifact in error.unresolved)
+
+        remaining = []
+        for member in members:
+            missing = [artifact.name for artifact in member.artifacts if artifact.name in unresolved]
+            if member.lock is not None:
+                missing += [artifact.name for (artifact, _) in member.lock.pinned() if artifact.name in unresolved]
+
+            if len(missing) > 0:
+                self._fail(member.server, 'Could not resolve %s' % ', '.join(sorted(set(missing))))
+            else:
+                remaining.append(member)
+        return remaining
+
+    def _discard_conflicting(self, members):
+        """
+        Fails the members pinning another build of an artifact than other members do and returns the others,
+        since the local repository only holds one build of each artifact. The build most members pin is kept.
+        """
+        builds = {}
+        for member in members:
+            if member.lock is not None:
+                for (artifact, pin) in member.lock.pinned():
+                    pinned_by = builds.setdefault(artifact.name, {}).setdefault(pin.sha1, [])
+                    if member not in pinned_by:
+                        pinned_by.append(member)
+
+        conflicts = {}
+        for (name, pinned_by) in builds.items():
+            kept = max(pinned_by, key=lambda sha1: len(pinned_by[sha1]))
+            for (sha1, others) in pinned_by.items():
+                if sha1 != kept:
+                    for member in others:
+                        conflicts.setdefault(member.server.name, []).append(name)
+
+        remaining = []
+        for member in members:
+            if member.server.name in conflicts:
+                self._fail(member.server, 'Other servers are pinned to another build of %s, '
+                                          'deploy this server on its own or update it'
+                           % ', '.join(sorted(conflicts[member.server.name])))
+            else:
+                remaining.append(member)
+        return remaining
+
+    def _resolve(self, resolver, members, update):
+        for member in members:
+            member.lock = member.server.filesystem.get_pinned_lock(member.artifact, member.plugins, update)
+        members = self._discard_conflicting(members)
+
+        pinned = {}
+        unpinned = {}
+        for member in members:
+            if member.lock is not None:
+                for (artifact, pin) in member.lock.pinned():
+                    pinned.setdefault(artifact.name, (artifact, pin))
+            else:
+                for artifact in member.artifacts:
+                    unpinned.setdefault(artifact.name, artifact)
+
+        self.logger.info('Resolving %d pinned and %d unpinned artifacts for %d servers',
+                         len(pinned), len(unpinned), len(members))
+
+        try:
+            resolver.fetch_pinned(list(pinned.values()))
+        except ArtifactUnresolvedException as e:
+            members = self._discard_unresolved(members, e)
+
+        for artifact in unpinned.values():
+            resolver.enqueue(artifact)
+        try:
+            resolver.resolve()
+        except ArtifactUnresolvedException as e:
+            members = self._discard_unresolved(members, e)
+
+        locked = []
+        for member in members:
+            if member.lock is None:
+                try:
+                    member.lock = member.server.filesystem.lock_artifacts(resolver, member.artifact, member.plugins)
+                except TequilaException as e:
+                    self._fail(member.server, e.message)
+                    continue
+            locked.append(member)
+        return locked
+
+    def _materialize(self, resolver, member, stage):
+        try:
+            member.server.filesystem.materialize(resolver, member.lock, stage)
+        except TequilaException as e:
+            self._fail(member.server, e.message)
+        except Exception as e:
+            member.server.logger.exception(e)
+            self.failed[member.server.name] = str(e)
+
+    def deploy(self, refresh=False, update=False, offline=False, stage=False):
+        members, repositories = self._repositories(self._load(stage))
+        if len(members) > 0:
+            resolver = ServerFilesystem.create_resolver(repositories, refresh, update, offline)
+            members = self._resolve(resolver, members, update)
+
+            with ThreadPoolExecutor(max_workers=resolver.concurrency) as executor:
+                for member in members:
+                    executor.submit(self._materialize, resolver, member, stage)
+
+        deployed = len(self.servers) - len(self.failed)
+        self.logger.info('Deployed %d of %d servers', deployed, len(self.servers))
+        for name in sorted(self.failed):
+            self.logger.error('  - %s: %s', name, self.failed[name])
+
+        if len(self.failed) > 0:
+            raise FleetDeployFailedException(sorted(self.failed))
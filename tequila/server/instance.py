@@ -28,6 +28,7 @@ from tempfile import gettempdir
 
 from .control import Controlled
 from .exception import ServerRunningException, ServerException
+from .ports import PortAllocator
 
 from .wrapper import Wrapper
 
@@ -83,6 +84,12 @@ class InstanceNotCleanException(ServerException):
                          instance.server, id=instance.instance_id, dir=instance.home)
 
 
+class NoPortAvailableException(ServerException):
+    def __init__(self, instance, low, high):
+        super().__init__('No port is available between $low and $high for instance #$id of server $name',
+                         instance.server, id=instance.instance_id, low=low, high=high)
+
+
 class ServerInstance(Controlled):
 
     def __init__(self, server, id):
@@ -96,6 +103,9 @@ class ServerInstance(Controlled):
         self.server_home = self.server.home
         self.server.home = self.home = join(self.instance_directory, str(self.instance_id))
 
+        # held by the watchdog while the instance runs, with dynamic binding
+        self.port_lease = None
+
         control = ServerControl(self.server)
         control.wrapper = InstanceWrapper(self, control.wrapper)
 
@@ -110,7 +120,23 @@ class ServerInstance(Controlled):
         if os.name != 'posix':
             raise NotImplementedError('Scanning available ports is only available on *nix.')
 
-        return net.get_open_ports(low, high)[0]
+        port = net.get_open_port(low, high)
+        if port is None:
+            raise NoPortAvailableException(self, low, high)
+        return port
+
+    def lease_port(self):
+        """
+        Reserves a port for the instance on behalf of the calling process, until it releases it or dies.
+        """
+        from tequila import Tequila
+
+        low, high = self.control_interface.wrapper.port_range()
+        allocator = PortAllocator(Tequila().get_port_leases_file())
+        lease = allocator.allocate(low, high, '%s#%d' % (self.server.name, self.instance_id))
+        if lease is None:
+            raise NoPortAvailableException(self, low, high)
+        return lease
 
     def get_id(self, instance_id):
         if instance_id > 0:
@@ -141,12 +167,20 @@ class ServerInstance(Controlled):
             init(self)
 
             try:
+                # the watchdog lives as long as the instance, so it holds the lease
+                if self.server.config.get_instance_binding_policy() == BindingPolicy.dynamic:
+                    self.port_lease = self.lease_port()
+
                 do_as_user(self.server.config.get_user(), self._start)
+                # the server was started by another process
+                self.control_interface.wrapper.invalidate()
 
                 self.control_interface.wrapper.wait(dt=5)
             except Exception as e:
                 self.server.logger.exception(e)
             finally:
+                if self.port_lease is not None:
+                    self.port_lease.release()
                 delete(self)
 
 
@@ -168,12 +202,18 @@ class InstanceWrapper(Wrapper):
         self.wrapper.get_jvm_opts = self.get_jvm_opts
         self.wrapper.get_server_opts = self.get_server_opts
 
-    def port(self):
+    def port_range(self):
         port_range = self.server.config.get_instance_port_range()
         low = max(1 << 10, int(port_range[0]) if len(port_range) > 0 else 1 << 10)
         high = max(low, int(port_range[1]) if len(port_range) > 1 else (1 << 16) - 1)
+        return low, high
+
+    def port(self):
+        low, high = self.port_range()
 
         if self.server.config.get_instance_binding_policy() == BindingPolicy.dynamic:
+            if self.instance.port_lease is not None:
+                return self.instance.port_lease.port
             return self.instance.find_available_port(low, high)
         else:
             return min(high, low + self.instance.instance_id - 1)
@@ -201,6 +241,12 @@ class InstanceWrapper(Wrapper):
     def send(self, command):
         return self.wrapper.send(command)
 
+    def attach(self):
+        return self.wrapper.attach()
+
+    def invalidate(self):
+        return self.wrapper.invalidate()
+
 
 class InstanceGroup(Controlled):
 
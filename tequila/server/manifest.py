@@ -0,0 +1,95 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import json
+import os
+
+from ..util import dump_json
+
+MANIFEST_VERSION = 1
+
+
+class ManifestEntry(object):
+
+    def __init__(self, path, role, source, digest, size, mtime):
+        self.path = path
+        self.role = role
+        self.source = source
+        self.digest = digest
+        self.size = size
+        self.mtime = mtime
+
+    def matches(self, file):
+        """
+        Tells whether file is still what was deployed, trusting its size and modification time.
+        """
+        try:
+            st = os.stat(file)
+        except FileNotFoundError:
+            return False
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime
+
+    def to_dict(self):
+        return {
+            'role': self.role,
+            'source': self.source,
+            'digest': self.digest,
+            'size': self.size,
+            'mtime': self.mtime
+        }
+
+    @classmethod
+    def from_dict(cls, path, data):
+        return cls(path, data['role'], data['source'], data['digest'], data['size'], data['mtime'])
+
+    @classmethod
+    def of(cls, file, path, role, source, digest):
+        st = os.stat(file)
+        return cls(path, role, source, digest, st.st_size, st.st_mtime_ns)
+
+
+class DeploymentManifest(object):
+    """
+    Lists the files a deploy placed in a server directory, by path relative to the server home,
+    so that the next deploy only has to touch the files that changed.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.entries = {}
+
+    def load(self):
+        try:
+            with open(self.file, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != MANIFEST_VERSION:
+                return False
+
+            self.entries = dict((path, ManifestEntry.from_dict(path, entry))
+                                for (path, entry) in data['files'].items())
+        except (IOError, ValueError, KeyError, TypeError):
+            self.entries = {}
+            return False
+        return True
+
+    def save(self):
+        data = {
+            'version': MANIFEST_VERSION,
+            'files': dict((path, entry.to_dict()) for (path, entry) in self.entries.items())
+        }
+        dump_json(self.file, data, indent=2, sort_keys=True)
@@ -0,0 +1,165 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from os.path import dirname, exists
+
+from .wrapper import is_running
+from .. import net
+from ..util import dump_json
+
+LEASES_VERSION = 1
+
+
+class PortBitmap(object):
+    """
+    One bit per TCP port, set when the port is taken.
+    """
+
+    def __init__(self):
+        self.bits = bytearray(1 << 13)
+
+    def set(self, port):
+        self.bits[port >> 3] |= 1 << (port & 7)
+
+    def clear(self, port):
+        self.bits[port >> 3] &= ~(1 << (port & 7))
+
+    def test(self, port):
+        return bool(self.bits[port >> 3] & (1 << (port & 7)))
+
+    def _scan(self, low, high):
+        port = low
+        while port <= high:
+            # skip whole bytes of taken ports
+            if port & 7 == 0 and self.bits[port >> 3] == 0xFF:
+                port += 8
+                continue
+            if not self.test(port):
+                return port
+            port += 1
+        return None
+
+    def first_clear(self, low, high, start=None):
+        """
+        Returns the first clear port in [low, high] from start on, wrapping around to low, or None.
+        """
+        start = low if start is None or not low <= start <= high else start
+        port = self._scan(start, high)
+        if port is None and start > low:
+            port = self._scan(low, start - 1)
+        return port
+
+
+class PortLease(object):
+
+    def __init__(self, allocator, port, pid):
+        self.allocator = allocator
+        self.port = port
+        self.pid = pid
+
+    def release(self):
+        self.allocator.release(self.port, self.pid)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class PortAllocator(object):
+    """
+    Hands out ports to instances, keeping leases in a file shared by all tequila processes
+    so that two instances starting at the same time cannot pick the same port.
+    A lease is held by a process and is reclaimed once that process is dead.
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(dirname(self.file), 0o755, exist_ok=True)
+        fd = os.open(self.file + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _load(self):
+        if not exists(self.file):
+            return {'version': LEASES_VERSION, 'cursor': 0, 'leases': {}}
+
+        with open(self.file, 'r') as f:
+            data = json.load(f)
+        if data.get('version') != LEASES_VERSION:
+            raise ValueError('Unsupported port lease file version %s' % data.get('version'))
+        return data
+
+    def _save(self, data):
+        dump_json(self.file, data, indent=2, sort_keys=True)
+
+    @staticmethod
+    def _reclaim(leases):
+        for port in [port for (port, lease) in leases.items() if not is_running(lease['pid'])]:
+            del leases[port]
+
+    def allocate(self, low, high, owner, pid=None):
+        """
+        Leases the next port in [low, high] that is neither leased nor listened on, on behalf of the
+        process pid (this process by default). Returns the PortLease, or None if every port is taken.
+        """
+        pid = pid or os.getpid()
+        with self._locked():
+            data = self._load()
+            leases = data['leases']
+            self._reclaim(leases)
+
+            taken = PortBitmap()
+            for port in leases:
+                taken.set(int(port))
+            for port in net.get_listening_ports(low, high):
+                taken.set(port)
+
+            # the search goes on from the last allocation, released ports are found again after wrapping around
+            port = taken.first_clear(low, high, data['cursor'])
+            if port is None:
+                self._save(data)
+                return None
+
+            leases[str(port)] = {'pid': pid, 'owner': owner, 'acquired': int(time.time())}
+            data['cursor'] = port + 1
+            self._save(data)
+            return PortLease(self, port, pid)
+
+    def release(self, port, pid=None):
+        pid = pid or os.getpid()
+        with self._locked():
+            data = self._load()
+            lease = data['leases'].get(str(port))
+            if lease is None or lease['pid'] != pid:
+                return
+            del data['leases'][str(port)]
+            self._save(data)
@@ -65,6 +65,25 @@ class Wrapper(object):
     def get_server_opts(self, **kwargs):
         return self.server.get_server_opts(**kwargs)
 
+    def get_environment(self):
+        """
+        Returns the environment the start script of the server is run with.
+        """
+        env = os.environ.copy()
+        env['TEQUILA'] = 'true'
+        env['JAVA_OPTS'] = self.get_jvm_opts()
+        env['APP_OPTS'] = self.get_server_opts()
+
+        # java -jar ignores the class path, the server is started from its main class when there are libraries
+        libraries = self.server.get_library_paths()
+        main_class = self.server.get_main_class() if len(libraries) > 0 else None
+        if main_class is not None:
+            env['SERVER_CLASSPATH'] = os.pathsep.join(['server.jar'] + libraries)
+            env['MAIN_CLASS'] = main_class
+        elif len(libraries) > 0:
+            self.server.logger.warning('server.jar names no main class, the libraries will not be loaded')
+        return env
+
     def running(self):
         raise NotImplementedError
 
@@ -80,6 +99,16 @@ class Wrapper(object):
     def send(self, command):
         raise NotImplementedError
 
+    def attach(self):
+        from ..exception import ServerCannotBeJoinedException
+        raise ServerCannotBeJoinedException(self.server)
+
+    def invalidate(self):
+        """
+        Forgets what is known of the running servers, once one has been started or stopped.
+        """
+        pass
+
     def kill(self, force=False):
         os.kill(self.pid(), signal.SIGKILL if force else signal.SIGTERM)
 
@@ -94,11 +123,14 @@ class Wrapper(object):
             from ..exception import ServerNotRunningException
             raise ServerNotRunningException(self.server)
 
+        pid = self.pid()
         if force or harder:
             self.kill(harder)
         else:
             self.send(self.server.config.get_stop_command())
-            waitpid(self.pid())
+        # whatever is done next with the server, such as applying a staged deploy, needs it gone
+        waitpid(pid)
+        self.invalidate()
 
     def restart(self, force=False, harder=False):
         self.stop(force, harder, ignore_stopped=True)
@@ -114,4 +146,5 @@ def wrapper(name):
 
 from .screen import Screen
 from .daemon import Daemon
+from .terminal import Terminal
 
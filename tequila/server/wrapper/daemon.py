@@ -19,18 +19,169 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import re
+import selectors
+import signal
 import socket
 from os.path import join, exists
 from subprocess import Popen, PIPE
 
 from . import Wrapper, wrapper
-import select
 
 from ..exception import ServerNotRunningException, ServerException, ServerCannotBeJoinedException
 
 from ...daemonize import fork_and_daemonize
 from ...net import socket_connection
-from ...util import directory
+from ...util import directory, set_nonblocking
+
+
+BUFFER_SIZE = 64 * 1024
+# clients are not read from while that many bytes wait to be written to the server
+MAX_PENDING = 1024 * 1024
+
+
+class ExitNotifier(object):
+    """
+    A file descriptor that becomes readable when a child process exits: a pidfd
+    where the kernel supports it, or a pipe written to on SIGCHLD otherwise.
+    """
+
+    def __init__(self, pid):
+        self.fd = None
+        self._pipe = None
+        try:
+            self.fd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            self._pipe = os.pipe()
+            for fd in self._pipe:
+                set_nonblocking(fd)
+            signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+            signal.set_wakeup_fd(self._pipe[1])
+            self.fd = self._pipe[0]
+
+    def clear(self):
+        if self._pipe is not None:
+            try:
+                while os.read(self.fd, BUFFER_SIZE):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self._pipe is not None:
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            for fd in self._pipe:
+                os.close(fd)
+        else:
+            os.close(self.fd)
+
+
+class CommandLoop(object):
+    """
+    Relays what the clients of the command socket send to the standard input of the server.
+    Any number of clients may be connected at once, and writes to the server are queued
+    so that a server slow to read its input does not block the clients.
+    """
+
+    def __init__(self, sock, proc, logger):
+        self.sock = sock
+        self.proc = proc
+        self.logger = logger
+
+        self.stdin = proc.stdin.fileno()
+        self.pending = bytearray()
+        self.clients = set()
+        self.reading = True
+        self.selector = selectors.DefaultSelector()
+
+    def _set_reading(self, reading):
+        # clients wait while the server is behind on its input
+        if reading == self.reading:
+            return
+        self.reading = reading
+        for client in self.clients:
+            if reading:
+                self.selector.register(client, selectors.EVENT_READ)
+            else:
+                self.selector.unregister(client)
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.sock.accept()
+            except BlockingIOError:
+                return
+            connection.setblocking(False)
+            self.clients.add(connection)
+            if self.reading:
+                self.selector.register(connection, selectors.EVENT_READ)
+
+    def _close(self, client):
+        self.clients.discard(client)
+        if self.reading:
+            self.selector.unregister(client)
+        client.close()
+
+    def _receive(self, client):
+        try:
+            data = client.recv(BUFFER_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.logger.exception(e)
+            data = b''
+
+        if not data:
+            self._close(client)
+            return
+
+        if not self.pending:
+            self.selector.register(self.stdin, selectors.EVENT_WRITE)
+        self.pending += data
+        if len(self.pending) >= MAX_PENDING:
+            self._set_reading(False)
+
+    def _flush(self):
+        try:
+            written = os.write(self.stdin, self.pending)
+        except BlockingIOError:
+            return
+        except BrokenPipeError:
+            # the server is exiting, the exit notifier ends the loop
+            written = len(self.pending)
+
+        del self.pending[:written]
+        if not self.pending:
+            self.selector.unregister(self.stdin)
+        if len(self.pending) < MAX_PENDING:
+            self._set_reading(True)
+
+    def run(self):
+        notifier = ExitNotifier(self.proc.pid)
+        set_nonblocking(self.stdin)
+        self.sock.setblocking(False)
+        self.sock.listen(socket.SOMAXCONN)
+
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.selector.register(notifier.fd, selectors.EVENT_READ)
+        try:
+            # the server may have exited before the notifier existed
+            while self.proc.poll() is None:
+                for key, _ in self.selector.select():
+                    if key.fileobj is self.sock:
+                        self._accept()
+                    elif key.fileobj == notifier.fd:
+                        notifier.clear()
+                    elif key.fileobj == self.stdin:
+                        self._flush()
+                    else:
+                        self._receive(key.fileobj)
+        finally:
+            for client in list(self.clients):
+                self._close(client)
+            self.selector.close()
+            notifier.close()
+            self.sock.close()
 
 
 @wrapper('daemon')
@@ -61,40 +212,10 @@ class Daemon(Wrapper):
         return join(self.socket_dir(), self.socket)
 
     def serve_commands(self, sock, proc):
-        try:
-            sock.listen(1)
-
-            while proc.poll() is None:
-                readable, _, errored = select.select([sock], [], [sock], 1)
-
-                if sock in readable:
-                    connection, client_address = sock.accept()
-                    try:
-                        if proc.poll() is not None:
-                            return
-
-                        while True:
-                            data = connection.recv(512)
-                            if not data:
-                                break
-
-                            proc.stdin.write(data)
-                            proc.stdin.flush()
-                    except Exception as e:
-                        self.server.logger.exception(e)
-                    finally:
-                        connection.close()
-
-                if sock in errored:
-                    return
-        finally:
-            sock.close()
+        CommandLoop(sock, proc, self.server.logger).run()
 
     def start(self):
-        env = os.environ.copy()
-        env['TEQUILA'] = 'true'
-        env['JAVA_OPTS'] = self.get_jvm_opts()
-        env['APP_OPTS'] = self.get_server_opts()
+        env = self.get_environment()
 
         os.makedirs(self.socket_dir(), exist_ok=True)
 
@@ -103,20 +224,28 @@ class Daemon(Wrapper):
 
         if fork_and_daemonize():
 
+            pid_file = join(self.server.home, '.pid')
             try:
                 with directory(self.server.home):
+                    # left behind by a server that did not exit cleanly
+                    if exists(self.socket_address()):
+                        os.remove(self.socket_address())
+
                     sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
                     sock.setblocking(0)
                     sock.bind(self.socket_address())
 
                     proc = Popen(['./start'], env=env, stdin=PIPE)
 
-                    with open(join(self.server.home, '.pid'), 'w') as f:
+                    with open(pid_file, 'w') as f:
                         f.write(ascii(proc.pid))
 
                     self.serve_commands(sock, proc)
                     proc.wait()
             finally:
+                for file in (pid_file, self.socket_address()):
+                    if exists(file):
+                        os.remove(file)
                 os._exit(0)
 
     def send(self, command):
@@ -17,45 +17,87 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import os
 import re
-from subprocess import call, getoutput
+import threading
+from subprocess import call, check_output, CalledProcessError, STDOUT
 
 from ...util import directory
 from . import Wrapper, wrapper
 
 
+# a session line of screen -ls: the pid and name of the session, an optional date and the state
+SESSION = re.compile(r'^\s+(\d+)\.(\S+)\s.*\(([^()]*)\)\s*$')
+
+
+def parse_sessions(listing):
+    """
+    Parses a screen session listing into a name: (pid, state) dict, leaving the dead sessions out.
+    """
+    sessions = {}
+    for line in listing.splitlines():
+        match = SESSION.match(line)
+        if match is None or match.group(3).startswith(('Dead', 'Removed')):
+            continue
+        sessions[match.group(2)] = (int(match.group(1)), match.group(3))
+    return sessions
+
+
 @wrapper('screen')
 class Screen(Wrapper):
 
+    # sessions listed by screen, shared by all the servers until invalidated
+    _sessions = None
+    _sessions_lock = threading.Lock()
+
     def __init__(self, server, id):
         super().__init__(server, 'tequila_' + re.sub(r'[^a-zA-Z0-9\-_]', '', id))
 
+    @classmethod
+    def sessions(cls):
+        """
+        Returns the live screen sessions, listing them with a single screen call the first time.
+        """
+        with cls._sessions_lock:
+            if cls._sessions is None:
+                cls._sessions = parse_sessions(cls.wipe())
+            return cls._sessions
+
+    @classmethod
+    def invalidate(cls):
+        with cls._sessions_lock:
+            cls._sessions = None
+
     def running(self):
         return self.pid() != 0
 
     def status(self):
-        Screen.wipe()
-        lines = getoutput('screen -ls | grep -E "[0-9]+\.%s"' % self.wrapper_id).splitlines(keepends=False)
-        return lines[0].split('\t')[2].strip('()') if len(lines) > 0 else 'Dead'
+        session = self.sessions().get(self.wrapper_id)
+        return session[1] if session is not None else 'Dead'
 
     def pid(self):
-        Screen.wipe()
-        lines = getoutput('screen -ls | grep -E "[0-9]+\\.%s"' % self.wrapper_id).splitlines(keepends=False)
-        return int(lines[0].split('\t')[1].split('.')[0]) if len(lines) > 0 else 0
+        session = self.sessions().get(self.wrapper_id)
+        return session[0] if session is not None else 0
 
     def start(self):
-        env = os.environ.copy()
-        env['TEQUILA'] = 'true'
-        env['JAVA_OPTS'] = self.get_jvm_opts()
-        env['APP_OPTS'] = self.get_server_opts()
+        env = self.get_environment()
 
         with directory(self.server.home):
             call(['screen', '-q', '-dmS', self.wrapper_id, './start'], env=env)
+        self.invalidate()
 
     def send(self, command):
         call(['screen', '-q', '-S', self.wrapper_id, '-p', '0', '-X', 'stuff', command + '\r'])
 
+    def attach(self):
+        call(['screen', '-r', self.wrapper_id])
+
     @classmethod
     def wipe(cls):
-        call(['screen', '-q', '-wipe'])
\ No newline at end of file
+        """
+        Removes the dead sessions and returns the listing of the sessions.
+        """
+        try:
+            return check_output(['screen', '-wipe'], stderr=STDOUT, universal_newlines=True)
+        except CalledProcessError as e:
+            # screen exits with an error status when there is no session
+            return e.output
\ No newline at end of file
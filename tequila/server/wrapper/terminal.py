@@ -0,0 +1,361 @@
+"""
+Tequila: a command-line Minecraft server manager written in python
+
+Copyright (C) 2014 Snaipe
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import errno
+import fcntl
+import json
+import os
+import pty
+import re
+import select
+import selectors
+import socket
+import struct
+import sys
+import termios
+import tty
+from os.path import join, exists
+from time import sleep, time
+
+from . import Wrapper, wrapper, is_running
+
+from ..exception import ServerNotRunningException, ServerException, ServerCannotBeJoinedException
+
+from ...daemonize import fork_and_daemonize
+from ...util import directory, dump_json, set_nonblocking, umask
+
+# bytes of console output replayed to the clients attaching
+SCROLLBACK_SIZE = 64 * 1024
+BUFFER_SIZE = 64 * 1024
+# bytes of input held for the server before the clients stop being read
+MAX_PENDING = 1024 * 1024
+
+# Ctrl-]
+DETACH_KEY = b'\x1d'
+
+# seconds the session is given to start the server and write its state
+START_TIMEOUT = 5
+
+
+class _Client(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.mode = None
+        self.header = b''
+
+
+class TerminalSession(object):
+    """
+    Runs the server on a pseudo-terminal and relays it to the clients of a unix socket.
+    A client first sends a header line, either "attach <rows> <columns>" to share the console
+    until it disconnects, or "send" to only write its input to the console.
+    """
+
+    def __init__(self, terminal, env):
+        self.terminal = terminal
+        self.env = env
+
+        self.pid = 0
+        self.started = 0
+        self.master = None
+        self.selector = selectors.DefaultSelector()
+        self.clients = {}
+        self.scrollback = bytearray()
+        self.pending = bytearray()
+        self.reading = True
+
+    def _save_state(self):
+        dump_json(self.terminal.state_file(), {
+            'pid': self.pid,
+            'supervisor': os.getpid(),
+            'attached': sum(1 for client in self.clients.values() if client.mode == 'attach'),
+            'started': self.started
+        })
+
+    def _spawn(self):
+        pid, master = pty.fork()
+        if pid == 0:
+            try:
+                os.execve('./start', ['./start'], self.env)
+            finally:
+                os._exit(127)
+        return pid, master
+
+    def _set_reading(self, reading):
+        # clients wait while the server is behind on its input
+        if reading == self.reading:
+            return
+        self.reading = reading
+        for connection in self.clients:
+            if reading:
+                self.selector.register(connection, selectors.EVENT_READ)
+            else:
+                self.selector.unregister(connection)
+
+    def _close(self, client):
+        attached = client.mode == 'attach'
+        if self.reading:
+            self.selector.unregister(client.connection)
+        del self.clients[client.connection]
+        client.connection.close()
+        if attached:
+            self._save_state()
+
+    def _accept(self, sock):
+        connection, _ = sock.accept()
+        # sends block for a second at most, readiness is known from the selector
+        connection.settimeout(1)
+        self.clients[connection] = _Client(connection)
+        if self.reading:
+            self.selector.register(connection, selectors.EVENT_READ)
+
+    def _attach(self, client, arguments):
+        if len(arguments) == 2:
+            rows, columns = int(arguments[0]), int(arguments[1])
+            fcntl.ioctl(self.master, termios.TIOCSWINSZ, struct.pack('HHHH', rows, columns, 0, 0))
+
+        client.connection.sendall(bytes(self.scrollback))
+        self._save_state()
+
+    def _receive(self, client):
+        data = client.connection.recv(BUFFER_SIZE)
+        if not data:
+            self._close(client)
+            return
+
+        if client.mode is None:
+            client.header += data
+            if b'\n' not in client.header:
+                return
+
+            line, data = client.header.split(b'\n', 1)
+            fields = line.decode('ascii', 'replace').split()
+            client.mode = fields[0] if len(fields) > 0 else 'send'
+            if client.mode == 'attach':
+                self._attach(client, fields[1:])
+
+        if data:
+            if not self.pending:
+                self.selector.modify(self.master, selectors.EVENT_READ | selectors.EVENT_WRITE)
+            self.pending += data
+            if len(self.pending) >= MAX_PENDING:
+                self._set_reading(False)
+
+    def _flush(self):
+        try:
+            written = os.write(self.master, self.pending)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            # writing to the master side fails with EIO once the server is gone, reading it ends the session
+            if e.errno != errno.EIO:
+                raise
+            written = len(self.pending)
+
+        del self.pending[:written]
+        if not self.pending:
+            self.selector.modify(self.master, selectors.EVENT_READ)
+        if len(self.pending) < MAX_PENDING:
+            self._set_reading(True)
+
+    def _output(self):
+        try:
+            data = os.read(self.master, BUFFER_SIZE)
+        except BlockingIOError:
+            return True
+        except OSError as e:
+            # reading the master side fails with EIO once the server is gone
+            if e.errno != errno.EIO:
+                raise
+            data = b''
+
+        if not data:
+            return False
+
+        self.scrollback += data
+        if len(self.scrollback) > SCROLLBACK_SIZE:
+            del self.scrollback[:len(self.scrollback) - SCROLLBACK_SIZE]
+
+        for client in [c for c in self.clients.values() if c.mode == 'attach']:
+            try:
+                client.connection.sendall(data)
+            except OSError:
+                self._close(client)
+        return True
+
+    def run(self):
+        address = self.terminal.socket_address()
+        if exists(address):
+            os.remove(address)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # the session runs with the umask of a daemon, anyone could write to the console otherwise
+        with umask(0o077):
+            sock.bind(address)
+        sock.listen(8)
+        sock.setblocking(False)
+
+        self.started = int(time())
+        self.pid, self.master = self._spawn()
+        set_nonblocking(self.master)
+        self._save_state()
+
+        self.selector.register(sock, selectors.EVENT_READ)
+        self.selector.register(self.master, selectors.EVENT_READ)
+        try:
+            while True:
+                for key, events in self.selector.select():
+                    if key.fileobj is sock:
+                        self._accept(sock)
+                    elif key.fileobj == self.master:
+                        if events & selectors.EVENT_WRITE:
+                            self._flush()
+                        if events & selectors.EVENT_READ and not self._output():
+                            return
+                    elif key.fileobj in self.clients:
+                        try:
+                            self._receive(self.clients[key.fileobj])
+                        except OSError:
+                            self._close(self.clients[key.fileobj])
+        finally:
+            for client in list(self.clients.values()):
+                self._close(client)
+            sock.close()
+            os.close(self.master)
+            os.waitpid(self.pid, 0)
+
+            for file in (address, self.terminal.state_file()):
+                if exists(file):
+                    os.remove(file)
+
+
+@wrapper('pty')
+class Terminal(Wrapper):
+    """
+    Runs the server on a pseudo-terminal owned by a tequila process, without GNU screen.
+    The console can be attached to from any terminal and detached from with Ctrl-].
+    """
+
+    def __init__(self, server, id):
+        super().__init__(server, 'tequila_' + re.sub(r'[^a-zA-Z0-9\-_]', '', id))
+
+    def state_file(self):
+        return join(self.server.home, '.terminal')
+
+    def socket_address(self):
+        return join(self.server.home, '.terminal.sock')
+
+    def state(self):
+        try:
+            with open(self.state_file(), 'r') as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None
+        return state if is_running(state.get('pid', 0)) else None
+
+    def running(self):
+        return self.state() is not None
+
+    def status(self):
+        state = self.state()
+        if state is None:
+            return 'Dead'
+        return 'Attached' if state.get('attached', 0) > 0 else 'Detached'
+
+    def pid(self):
+        state = self.state()
+        return state['pid'] if state is not None else 0
+
+    def start(self):
+        env = self.get_environment()
+
+        if not exists(self.server.home):
+            raise ServerException('Could not find the home of server $name', self.server)
+
+        if fork_and_daemonize():
+            status = 0
+            try:
+                with directory(self.server.home):
+                    TerminalSession(self, env).run()
+            except Exception as e:
+                self.server.logger.exception(e)
+                status = 1
+            finally:
+                os._exit(status)
+
+        # the server is only known to run once the session wrote its state
+        deadline = time() + START_TIMEOUT
+        while not self.running() and time() < deadline:
+            sleep(0.05)
+
+        if not self.running():
+            raise ServerException('Server $name did not start within $timeout seconds', self.server,
+                                  timeout=START_TIMEOUT)
+
+    def _connect(self, header):
+        if not self.running():
+            raise ServerNotRunningException(self.server)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_address())
+        except (ConnectionRefusedError, FileNotFoundError) as e:
+            sock.close()
+            raise ServerCannotBeJoinedException(self.server) from e
+
+        sock.sendall(header.encode('ascii') + b'\n')
+        return sock
+
+    def send(self, command):
+        with self._connect('send') as sock:
+            sock.sendall((command + '\r').encode('utf-8'))
+
+    def attach(self):
+        if not sys.stdin.isatty():
+            raise ServerCannotBeJoinedException(self.server)
+
+        size = os.get_terminal_size()
+        sock = self._connect('attach %d %d' % (size.lines, size.columns))
+
+        stdin, stdout = sys.stdin.fileno(), sys.stdout.fileno()
+        print('Attached to %s, press Ctrl-] to detach.' % self.server.name)
+        sys.stdout.flush()
+
+        mode = termios.tcgetattr(stdin)
+        try:
+            tty.setraw(stdin)
+            while True:
+                readable, _, _ = select.select([stdin, sock], [], [])
+                if sock in readable:
+                    data = sock.recv(BUFFER_SIZE)
+                    if not data:
+                        break
+                    os.write(stdout, data)
+
+                if stdin in readable:
+                    data = os.read(stdin, BUFFER_SIZE)
+                    if DETACH_KEY in data:
+                        sock.sendall(data[:data.index(DETACH_KEY)])
+                        break
+                    sock.sendall(data)
+        finally:
+            termios.tcsetattr(stdin, termios.TCSADRAIN, mode)
+            sock.close()
+        print()
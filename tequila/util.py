@@ -19,10 +19,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from contextlib import contextmanager
 from fnmatch import fnmatch
 
+import json
 import os
 from pwd import getpwnam
 import shutil
 import sys
+from tempfile import NamedTemporaryFile
 
 
 def copy(src, dst):
@@ -31,6 +33,32 @@ def copy(src, dst):
     shutil.copy(src, dst)
 
 
+def write_atomically(target, write, mode='w', permissions=0o644):
+    """
+    Calls write with a temporary file next to target, then puts it in place of target,
+    so that readers see either the previous content or the new one in full.
+    """
+    with NamedTemporaryFile(mode, dir=os.path.dirname(target), prefix='.tequila', delete=False) as f:
+        try:
+            write(f)
+        except:
+            os.remove(f.name)
+            raise
+    os.chmod(f.name, permissions)
+    os.replace(f.name, target)
+
+
+def dump_json(target, obj, **kwargs):
+    """
+    Writes obj to target as JSON, atomically.
+    """
+    def write(f):
+        json.dump(obj, f, **kwargs)
+        if kwargs.get('indent') is not None:
+            f.write('\n')
+    write_atomically(target, write)
+
+
 @contextmanager
 def directory(dirname):
     old = os.getcwd()
@@ -50,6 +78,11 @@ def umask(mask):
         os.umask(old)
 
 
+def set_nonblocking(fd):
+    import fcntl
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
 class FileMatcher(object):
 
     def __init__(self, patterns):